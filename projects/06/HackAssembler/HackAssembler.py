@@ -1,133 +1,429 @@
 from sys import argv, exit
-from assembly_tables import symbols_table, comp_table, dest_table, jump_table
+from os.path import splitext, isdir, isfile, join
+from array import array
+from glob import glob, has_magic
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import argparse
+import json
+import time
+from assembly_cache import AssemblyCache, DEFAULT_DIR, DEFAULT_MAX_SIZE
+from hack_binary import write_hackb
+from assembly_optimizer import peephole
+from assembly_tables import symbols_table, comp_codes, dest_codes, jump_codes, c_instructions
+
+# Biggest value that fits in the 15 bits of an A-instruction
+MAX_ADDRESS = 0x7FFF
 
-def del_space():
-    ''' Return a list with the lines of the assembly code
-    without spaces, empty lines and comments '''
-    with open(argv[1]) as file:
-        code_lines= []
+def clean_line(line):
+    ''' Returns the line without white spaces, new lines and comments '''
+    index = line.find('/')
+    if index != -1:
+        line = line[:index]
 
-        #Iterate over lines in the file to remove withe spaces, new lines and comments
-        for line in file:
-            line = line.replace(" ", "").replace("\n", "")
-            if '/' in line:
-                index = line.index('/')
-                line = line.strip(line[index:])
+    return ''.join(line.split())
 
-            # Appends lines of the code to the list
-            if line != "":
-                code_lines.append(line)
 
-        return code_lines
+def code_lines(lines):
+    ''' Yields one at a time (line number, line) of the lines of the assembly
+    code without spaces, empty lines and comments '''
+    for number, line in enumerate(lines, 1):
+        line = clean_line(line)
+        if line != '':
+            yield number, line
 
 
-def C_parser(line, comp = '', dest = '', jump = ''):
-    ''' Take a C-instruction from the code list
+def C_parser(line):
+    ''' Take a C-instruction from the code
     and returns a tuple with comp, dest and jump '''
-    for e in range(len(line)):
-        if line[e] == '=':
-            dest = line[:e]
-            comp = line[e + 1:]
-            jump = 'null'
-        elif line[e] == ';':
-            jump = line[e + 1:]
-            comp = line[:e]
-            dest = 'null'
+    dest, jump = 'null', 'null'
+
+    index = line.find(';')
+    if index != -1:
+        jump = line[index + 1:]
+        line = line[:index]
 
-    return comp, dest, jump
+    index = line.find('=')
+    if index != -1:
+        dest = line[:index]
+        line = line[index + 1:]
+
+    return line, dest, jump
 
 
 def A_translate(value):
-    ''' Translate an A-instruction in int form to its binary form as a string '''
-    if value == 0:
-        return '0000000000000000'
+    ''' Returns the A-instruction of the given int address as a 16-bit int '''
+    if not 0 <= value <= MAX_ADDRESS:
+        raise ValueError(f'A-instruction value out of range: {value}')
+
+    return value
+
+
+def check_symbol(symbol):
+    ''' Raises ValueError if the symbol is empty or starts with a digit or a minus, like @-1 or @12abc '''
+    if symbol[:1] == '' or symbol[0].isdigit() or symbol[0] == '-':
+        raise ValueError(f"invalid symbol '{symbol}'")
+
+
+def C_error(line):
+    ''' Returns the message explaining why the c-instruction is not valid '''
+    comp, dest, jump = C_parser(line)
+    if dest not in dest_codes or '=' in line and dest == 'null':
+        return f"invalid dest '{dest}' in C-instruction '{line}'"
+    if jump not in jump_codes or ';' in line and jump == 'null':
+        return f"invalid jump '{jump}' in C-instruction '{line}'"
+    if comp not in comp_codes:
+        return f"invalid comp '{comp}' in C-instruction '{line}'"
 
-    def dec_to_bin(value, result = ''):
+    return f"invalid C-instruction '{line}'"
+
+
+class Assembler(object):
+    '''
+    Translates programs written in the Hack assembly language into
+    Hack machine code. Every program assembled starts from a fresh copy
+    of the predefined symbols, so one instance can be reused for many programs
+    '''
+
+    def __init__(self, var_base = 16):
         '''
-        Converts a decimal value to binary and returns it in string form
+        Attributes: symbols table, labels and variables of the last program,
+        first RAM address of the variables
         '''
-        while len(result) < 15:
-            result = str(value % 2) + result
-            value = value // 2
+        self.symbols = dict(symbols_table)
+        self.labels, self.variables = {}, {}
+        self.var_base = var_base
+
 
-        return result
+    def first_pass(self, lines):
+        '''
+        Streams the code and adds the labels (xxx) to a new symbols table
+        with the address of the instruction that follows them.
+        Returns the number of instructions. Errors raise ValueError with the line number
+        '''
+        self.labels = labels = {}
+        address = 0
+        try:
+            for number, line in code_lines(lines):
+                if line[0] == '(':
+                    check_symbol(line[1:-1])
+                    labels[line[1:-1]] = address
+                else:
+                    address += 1
+        except ValueError as error:
+            raise ValueError(f'line {number}: {error}') from None
 
-    return '0' + dec_to_bin(value)
+        self.symbols = dict(symbols_table)
+        self.symbols.update(labels)
+        return address
 
 
-def C_translate(cdj, c = '', d = '', j = ''):
-    ''' Returns a string with the c-instruction
-    converted in binary '''
-    if cdj[0] in comp_table[0]:
-        c = '0' + comp_table[0][cdj[0]]
-    else:
-        c = '1' + comp_table[1][cdj[0]]
+    def second_pass(self, lines):
+        '''
+        Streams the code again and yields every instruction encoded as an int.
+        New variable symbols are allocated in RAM starting from var_base.
+        Errors raise ValueError with the line number
+        '''
+        symbols = self.symbols
+        self.variables = variables = {}
+        c_lookup = c_instructions.get
+        n = self.var_base
+        try:
+            for number, line in code_lines(lines):
+                if line[0] == '(':
+                    continue
+
+                # Manage the a-inst and checks if it's a variable symbol
+                if line[0] == '@':
+                    address = line[1:]
+                    if not address.isdigit():
+                        if address not in symbols:
+                            check_symbol(address)
+                            symbols[address] = variables[address] = n
+                            n += 1
+                        yield A_translate(symbols[address])
+                    else:
+                        yield A_translate(int(address))
+
+                # The whole c-inst is translated with one lookup
+                else:
+                    word = c_lookup(line)
+                    if word is None:
+                        raise ValueError(C_error(line))
+                    yield word
+        except ValueError as error:
+            raise ValueError(f'line {number}: {error}') from None
 
-    d = dest_table[cdj[1]]
-    j = jump_table[cdj[2]]
 
-    return '111' + c + d + j
+    def assemble(self, code):
+        '''
+        Returns the ROM image of the code as an array of 16-bit words.
+        Arguments:
+            - code (string with the whole program, or iterable of lines)
+        '''
+        if isinstance(code, str):
+            code = code.splitlines()
+        # One-shot iterators can't be read twice
+        elif iter(code) is code:
+            code = list(code)
 
+        self.first_pass(code)
+        return array('H', self.second_pass(code))
 
-def check_symbol(symbol, val):
-    ''' If the symbol it's new it's a new variable: append it to the symbols table.
-    Returns the corresponding value in the table '''
-    global n
-    n = val
-    if symbol not in symbols_table:
-        symbols_table[symbol] = str(n)
-        n += 1
 
-    return symbols_table[symbol]
+    def assemble_file(self, path):
+        ''' Returns the ROM image of the assembly file, reading it twice from disk '''
+        with open(path) as file:
+            self.first_pass(file)
+            file.seek(0)
+            return array('H', self.second_pass(file))
+
+
+    def listing(self, lines):
+        '''
+        Streams the code of the last program assembled and yields
+        (ROM address, source line number, enclosing label, instruction)
+        for every instruction
+        '''
+        address, label = 0, ''
+        for number, line in enumerate(lines, 1):
+            line = clean_line(line)
+            if line == '':
+                continue
+            if line[0] == '(':
+                label = line[1:-1]
+            else:
+                yield address, number, label, line
+                address += 1
 
 
-def check_labels(code_list, line = 0):
-    ''' Check for labels (xxx) in the code list, and add them in the symbols table '''
-    while line < len(code_list):
-        if code_list[line][0] == '(':
-            label = code_list[line].replace('(', '').replace(')', '')
-            symbols_table[label] = line
-            code_list.remove(code_list[line])
+    def symbol_map(self):
+        ''' Yields (kind, name, address) for the labels and then the variables, sorted by address '''
+        for kind, table in (('label', self.labels), ('variable', self.variables)):
+            for name, address in sorted(table.items(), key = lambda item: item[1]):
+                yield kind, name, address
+
+
+def hack_lines(rom):
+    ''' Yields the words of the ROM image in the textual .hack form '''
+    for word in rom:
+        yield format(word, '016b') + '\n'
+
+
+def write_hack(rom, path):
+    ''' Writes the ROM image in a new file.hack '''
+    with open(path, 'w') as file:
+        file.writelines(hack_lines(rom))
+
+
+def write_listing(assembler, source, code = None):
+    '''
+    Writes next to the source file.asm, as tab separated columns:
+        - file.lst: ROM address, line, enclosing label and source of every instruction
+        - file.sym: labels with their ROM address and variables with their RAM address
+    code is the list of lines actually assembled, if the source was optimized
+    '''
+    name = splitext(source)[0]
+    with open(name + '.lst', 'w') as file:
+        file.write('// address\tline\tlabel\tinstruction\n')
+        if code is None:
+            with open(source) as code:
+                file.writelines(listing_lines(assembler, code))
         else:
-            line += 1
+            file.writelines(listing_lines(assembler, code))
 
+    with open(name + '.sym', 'w') as file:
+        file.write('// kind\tname\taddress\n')
+        for kind, symbol, address in assembler.symbol_map():
+            file.write(f'{kind}\t{symbol}\t{address}\n')
 
-def main(n = 16):
-    ''' M A I N '''
-    if len(argv) != 2:
-        print("Usage: python HackAssembler.py file.asm")
-        exit(1)
 
-    # Code is a list of the code lines
-    code = del_space()
-    check_labels(code)
+def listing_lines(assembler, code):
+    ''' Yields the lines of the listing of the code '''
+    for address, number, label, line in assembler.listing(code):
+        yield f'{address}\t{number}\t{label}\t{line}\n'
 
-    for line in range(len(code)):
 
-        # Manage the a-inst and checks if it's a variable symbol
-        if code[line][0] == '@':
-            address = code[line].replace('@', '')
-            symbol = address[0].isalpha()
-            if symbol:
-                address = check_symbol(address, n)
+# Writers of the output formats: text for the official CPU emulator, compact binary
+writers = {'hack' : write_hack, 'hackb' : write_hackb}
 
-            # Translate the a-inst and replace it with its binary value in the code list
-            a_inst = A_translate(int(address))
-            code[line] = a_inst
 
-        # Unpack the c-inst, translate it and add it to the code list
+def write_rom(rom, source, out_format = 'hack'):
+    ''' Writes the ROM image of the source file.asm in file.hack or file.hackb '''
+    writers[out_format](rom, splitext(source)[0] + '.' + out_format)
+
+
+def find_sources(paths):
+    '''
+    Returns the sorted list of .asm files found in the given paths.
+    Directories are searched recursively, glob patterns are expanded
+    '''
+    sources = set()
+    for path in paths:
+        if isdir(path):
+            sources.update(glob(join(path, '**', '*.asm'), recursive = True))
+        elif has_magic(path):
+            sources.update(glob(path, recursive = True))
         else:
-            c_pack = C_parser(code[line])
-            c_inst = C_translate(c_pack)
-            code[line] = c_inst
+            sources.add(path)
 
-    #Write the code list in a new file.hack
-    program = argv[1].replace('asm', 'hack')
-    with open(program, 'w') as file:
-        for line in code:
-            file.write(line + '\n')
+    return sorted(sources)
 
-import time
-start_time = time.time()
-main()
-print("--- %s seconds ---" % (time.time() - start_time))
+
+def assemble_cached(path, cache = None, listing = False, optimize = 0):
+    '''
+    Returns (ROM image of the assembly file, True if it was found in the cache,
+    number of instructions removed by the optimizer or None if it didn't run).
+    optimize is the level of the optimizer: 0 off, 1 peephole pass, 2 peephole
+    pass assuming code addresses are only loaded through labels.
+    Without a cache, or when the listing and symbol map are
+    written too, the file is always assembled
+    '''
+    if cache is not None:
+        key = cache.key(path, optimize = optimize)
+        if not listing:
+            rom = cache.get(key)
+            if rom is not None:
+                return rom, True, None
+
+    assembler = Assembler()
+    code, removed = None, None
+    if optimize:
+        # The peephole pass runs on the whole cleaned code, before encoding
+        with open(path) as file:
+            code, removed = peephole([clean_line(line) for line in file], symbolic = optimize > 1)
+        rom = assembler.assemble(code)
+    else:
+        rom = assembler.assemble_file(path)
+
+    if cache is not None:
+        cache.put(key, rom)
+    if listing:
+        write_listing(assembler, path, code)
+
+    return rom, False, removed
+
+
+def assemble_job(path, cache = None, out_format = 'hack', listing = False, optimize = 0):
+    '''
+    Assembles one file of a batch in a worker process. Returns (path, number of words,
+    seconds, cache hit, instructions removed by the optimizer, error message or None)
+    '''
+    start_time = time.perf_counter()
+    try:
+        rom, hit, removed = assemble_cached(path, cache, listing, optimize)
+        write_rom(rom, path, out_format)
+    except Exception as error:
+        return path, 0, time.perf_counter() - start_time, False, None, f'{type(error).__name__}: {error}'
+
+    return path, len(rom), time.perf_counter() - start_time, hit, removed, None
+
+
+def report(path, n_words, seconds, hit, removed):
+    ''' Returns the line reporting the result of the assembly of a file '''
+    line = f'{path}: {n_words} words in {seconds:.3f} s'
+    if hit:
+        line += ' (cached)'
+    if removed is not None:
+        line += f' ({removed} instructions removed by the optimizer)'
+
+    return line
+
+
+def batch(sources, jobs = None, cache = None, out_format = 'hack', listing = False, optimize = 0):
+    '''
+    Assembles the files across a pool of jobs processes (default: one per core),
+    printing the time or the error of every file. Returns the number of failures
+    '''
+    failures, words, hits = 0, 0, 0
+    start_time = time.perf_counter()
+
+    # The workers get the size of the cache scanned once here, so they scan it
+    # again only if it gets full, and the entries they add are evicted at the end
+    if cache is not None:
+        cache.evict()
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        job = partial(assemble_job, cache = cache, out_format = out_format, listing = listing, optimize = optimize)
+        for path, n_words, seconds, hit, removed, error in pool.map(job, sources):
+            if error is None:
+                words += n_words
+                hits += hit
+                print(report(path, n_words, seconds, hit, removed))
+            else:
+                failures += 1
+                print(f'{path}: FAILED {error}')
+
+    elapsed = time.perf_counter() - start_time
+    print(f'--- {len(sources)} files, {failures} failed, {words} words in {elapsed:.3f} s ---')
+    if cache is not None:
+        cache.evict()
+        misses = len(sources) - failures - hits
+        cache.record(hits, misses)
+        print(f'--- cache: {hits} hits, {misses} misses ---')
+
+    return failures
+
+
+def parse_args(args):
+    ''' Returns the parsed command line arguments '''
+    parser = argparse.ArgumentParser(prog = 'HackAssembler.py',
+                                     description = 'Translates Hack assembly programs into Hack machine code')
+    parser.add_argument('paths', nargs = '*', metavar = 'file.asm/directory/glob',
+                        help = 'a file, or directories and glob patterns to assemble in batch')
+    parser.add_argument('-j', '--jobs', type = int, default = None,
+                        help = 'number of worker processes in batch mode (default: one per core)')
+    parser.add_argument('-f', '--format', choices = sorted(writers), default = 'hack',
+                        help = 'text .hack for the CPU emulator or binary .hackb (default: %(default)s)')
+    parser.add_argument('-l', '--listing', action = 'store_true',
+                        help = 'also write the listing file.lst and the symbol map file.sym')
+    parser.add_argument('-O', '--optimize', action = 'count', default = 0,
+                        help = 'remove redundant instructions with a peephole pass before encoding; '
+                               '-OO also assumes code addresses are only loaded through labels, as in VMtranslator.py output')
+    parser.add_argument('--no-cache', action = 'store_true',
+                        help = 'always assemble, without reading or writing the cache')
+    parser.add_argument('--cache-dir', default = DEFAULT_DIR,
+                        help = f'directory of the cache (default: {DEFAULT_DIR})')
+    parser.add_argument('--cache-size', type = float, default = DEFAULT_MAX_SIZE / (1024 * 1024),
+                        help = 'size of the cache in MB before old entries are evicted (default: %(default)g)')
+    parser.add_argument('--cache-stats', action = 'store_true',
+                        help = 'print the hit and miss statistics of the cache')
+
+    args = parser.parse_args(args)
+    if not args.paths and not args.cache_stats:
+        parser.error('no file, directory or glob pattern to assemble')
+
+    return args
+
+
+def main():
+    ''' M A I N '''
+    args = parse_args(argv[1:])
+    cache = None if args.no_cache else AssemblyCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+
+    if args.cache_stats:
+        print(json.dumps(AssemblyCache(args.cache_dir).stats()))
+        if not args.paths:
+            return
+
+    # Batch mode for directories, glob patterns and lists of files
+    if len(args.paths) != 1 or not isfile(args.paths[0]):
+        exit(1 if batch(find_sources(args.paths), args.jobs, cache, args.format, args.listing, args.optimize) else 0)
+
+    # The labels are resolved while counting the instructions, then the code
+    # is read a second time and encoded one instruction at a time.
+    # Errors are reported as in batch mode
+    path, n_words, seconds, hit, removed, error = assemble_job(args.paths[0], cache, args.format,
+                                                               args.listing, args.optimize)
+    if error is not None:
+        print(f'{path}: FAILED {error}')
+        exit(1)
+
+    print(report(path, n_words, seconds, hit, removed))
+    if cache is not None:
+        cache.record(hit, not hit)
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print("--- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,230 @@
+from sys import argv, exit
+from array import array
+import argparse
+import time
+from hack_binary import load_rom
+from assembly_tables import comp_codes, comp_aliases
+
+# Words of the RAM, screen and keyboard included, and addresses the A register can hold
+RAM_SIZE = 32768
+A_SIZE = 65536
+
+# Most instructions compiled in a single block
+MAX_BLOCK = 128
+
+# Computations whose result is always a 16-bit value, without masking
+unmasked = ['0', '1', 'D', 'A', 'M', 'D&A', 'D|A', 'D&M', 'D|M']
+
+# Conditions of the jumps on the 16-bit result v, indexed by the jump bits
+jump_conditions = { 1 : '0 < v < 0x8000',
+                    2 : 'v == 0',
+                    3 : 'v < 0x8000',
+                    4 : 'v >= 0x8000',
+                    5 : 'v != 0',
+                    6 : 'v == 0 or v >= 0x8000',
+                    7 : 'True' }
+
+
+def comp_expression(comp):
+    ''' Returns the Python expression of the computation, with {a} and {m} in place of A and M '''
+    expression = comp.replace('!', '~').replace('A', '{a}').replace('M', '{m}')
+    return expression if comp in unmasked else f'({expression}) & 0xFFFF'
+
+
+def alu_expression(bits):
+    '''
+    Returns the Python expression of the ALU given the 7 bits a zx nx zy ny f no
+    of a c-instruction, for the combinations that have no mnemonic
+    '''
+    a, zx, nx, zy, ny, f, no = [(bits >> i) & 1 for i in range(6, -1, -1)]
+    x = '0' if zx else 'D'
+    y = '0' if zy else '{m}' if a else '{a}'
+    if nx:
+        x = f'~{x}'
+    if ny:
+        y = f'~{y}'
+    out = f'({x}) + ({y})' if f else f'({x}) & ({y})'
+    if no:
+        out = f'~({out})'
+
+    return f'({out}) & 0xFFFF'
+
+
+# Python expressions of every computation, indexed by the a and c bits of the c-instruction
+comp_table = [alu_expression(bits) for bits in range(128)]
+for comp, code in comp_codes.items():
+    if comp not in comp_aliases:
+        comp_table[(code >> 6) & 0x7F] = comp_expression(comp)
+
+
+class Emulator(object):
+    '''
+    Runs Hack machine code. Every ROM word is decoded only once: the straight
+    line of instructions starting at an address, up to the first jump, is
+    compiled into one Python function updating A, D and the RAM, then reused
+    every time the program gets there. An A-instruction followed by a
+    c-instruction makes A a constant in the compiled code.
+    The loop @X, 0;JMP at X that ends the programs halts the emulator
+    '''
+
+    def __init__(self, rom):
+        '''
+        Attributes: ROM image, RAM as 16-bit words, registers PC, A and D,
+        instructions executed, True once the program reached its final loop,
+        compiled blocks and compiled single instructions indexed by their address
+        '''
+        self.rom = rom
+        self.ram = array('H', bytes(2 * RAM_SIZE))
+        self.pc, self.a, self.d = 0, 0, 0
+        self.cycles = 0
+        self.halted = False
+        self.blocks = [None] * A_SIZE
+        self.steps = [None] * A_SIZE
+
+
+    def block_source(self, pc, max_length):
+        ''' Returns (Python source of the function running the block at pc, number of its instructions) '''
+        rom = self.rom
+        lines = ['def block(A, D, RAM = RAM):']
+        end = min(len(rom), pc + max_length)
+        address, known = pc, None
+        while address < end:
+            word = rom[address]
+            address += 1
+            if word < 0x8000:
+                lines.append(f'    A = {word}')
+                known = word
+                continue
+
+            a = 'A' if known is None else str(known)
+            m = f'RAM[{a}]'
+            dest, jump = (word >> 3) & 7, word & 7
+            if dest == 0 and jump == 0:
+                continue
+            lines.append(f'    v = {comp_table[(word >> 6) & 0x7F].format(a = a, m = m)}')
+
+            # The jump goes to the value of A before the instruction changes it
+            target = a
+            if jump and dest & 4 and known is None:
+                lines.append('    t = A')
+                target = 't'
+            if dest & 1:
+                lines.append(f'    {m} = v')
+            if dest & 2:
+                lines.append('    D = v')
+            if dest & 4:
+                lines.append('    A = v')
+                known = None
+
+            if jump:
+                lines.append(f'    if {jump_conditions[jump]}: return {target}, A, D')
+                break
+
+        lines.append(f'    return {address}, A, D')
+        return '\n'.join(lines) + '\n', address - pc
+
+
+    def compile(self, pc, max_length, cache):
+        '''
+        Compiles the block of at most max_length instructions at pc and stores it
+        in the cache as (function, number of instructions). The final loop of the
+        program and the addresses past the end of the ROM are (None, 0)
+        '''
+        rom = self.rom
+        if pc >= len(rom) or max_length > 1 and rom[pc] == pc and pc + 1 < len(rom) and rom[pc + 1] & 0xE03F == 0xE007:
+            cache[pc] = None, 0
+            return cache[pc]
+
+        source, length = self.block_source(pc, max_length)
+        namespace = {'RAM' : self.ram}
+        exec(source, namespace)
+        cache[pc] = namespace['block'], length
+        return cache[pc]
+
+
+    def run(self, max_cycles = None):
+        '''
+        Runs the program from the current PC until it halts, or for exactly max_cycles
+        instructions. Returns the number of instructions executed.
+        Raises ValueError if the program addresses the RAM beyond its end
+        '''
+        blocks, steps = self.blocks, self.steps
+        pc, A, D = self.pc, self.a, self.d
+        limit = float('inf') if max_cycles is None else max_cycles
+        n = 0
+        try:
+            while n < limit:
+                entry = blocks[pc] or self.compile(pc, MAX_BLOCK, blocks)
+                if entry[0] is None:
+                    self.halted = True
+                    break
+                # The last instructions before the limit are run one at a time
+                if n + entry[1] > limit:
+                    entry = steps[pc] or self.compile(pc, 1, steps)
+                pc, A, D = entry[0](A, D)
+                n += entry[1]
+        except IndexError:
+            raise ValueError(f'RAM address out of range in the instructions from ROM[{pc}]') from None
+        finally:
+            self.pc, self.a, self.d = pc, A, D
+            self.cycles += n
+
+        return n
+
+
+def to_signed(value):
+    ''' Returns the 16-bit word as a signed int '''
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def parse_assignment(text):
+    ''' Returns (address, value) of an ADDRESS=VALUE argument '''
+    address, value = text.split('=')
+    return int(address), int(value)
+
+
+def parse_range(text):
+    ''' Returns the range of addresses of a START:END or ADDRESS argument '''
+    start, colon, end = text.partition(':')
+    return range(int(start), int(end) if colon else int(start) + 1)
+
+
+def parse_args(args):
+    ''' Returns the parsed command line arguments '''
+    parser = argparse.ArgumentParser(prog = 'HackEmulator.py',
+                                     description = 'Runs Hack machine code until it reaches its final loop')
+    parser.add_argument('path', metavar = 'file.hack/file.hackb')
+    parser.add_argument('-c', '--cycles', type = int, default = None,
+                        help = 'stop after this number of instructions (default: run until the program halts)')
+    parser.add_argument('--ram', type = parse_assignment, nargs = '+', default = [], metavar = 'ADDRESS=VALUE',
+                        help = 'initial values of RAM words')
+    parser.add_argument('--dump', type = parse_range, nargs = '+', default = [], metavar = 'START:END',
+                        help = 'RAM words to print at the end')
+    return parser.parse_args(args)
+
+
+def main():
+    ''' Main function '''
+    args = parse_args(argv[1:])
+    emulator = Emulator(load_rom(args.path))
+    for address, value in args.ram:
+        emulator.ram[address] = value & 0xFFFF
+
+    start_time = time.perf_counter()
+    try:
+        cycles = emulator.run(args.cycles)
+    except ValueError as error:
+        print(f'{args.path}: {error}')
+        exit(1)
+    seconds = time.perf_counter() - start_time
+
+    state = 'halted' if emulator.halted else f'stopped at ROM[{emulator.pc}]'
+    print(f'{args.path}: {state} after {cycles} instructions in {seconds:.3f} s '
+          f'({cycles / max(seconds, 1e-9) / 1e6:.2f} M instructions/s)')
+    for addresses in args.dump:
+        for address in addresses:
+            print(f'RAM[{address}] = {to_signed(emulator.ram[address])}')
+
+
+if __name__ == '__main__':
+    main()
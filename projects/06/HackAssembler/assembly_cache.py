@@ -0,0 +1,174 @@
+from array import array
+from hashlib import sha256
+from os.path import dirname, abspath
+from sys import byteorder
+import json
+import os
+
+# Sources of the encoding: entries written by any other version of them are never returned
+SOURCES = ['assembly_tables.py', 'HackAssembler.py', 'assembly_optimizer.py']
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'HackAssembler')
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def code_version(names = SOURCES, directory = dirname(abspath(__file__))):
+    ''' Returns the hash of the source files with the given names in the directory '''
+    digest = sha256()
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as file:
+            digest.update(name.encode() + b'\0' + file.read())
+
+    return digest.hexdigest()
+
+
+class FileCache(object):
+    '''
+    Directory of entries keyed by hashes, one file each with the given suffix.
+    When the entries grow over max_size bytes the least recently used are removed
+    '''
+
+    suffix = ''
+
+    def __init__(self, directory, max_size):
+        '''
+        Attributes: directory of the cache, maximum size of the entries in bytes,
+        size of the entries found by the last scan plus the ones written since,
+        None before the first scan
+        '''
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+
+
+    def entry(self, key):
+        ''' Returns the path of the entry with the given key '''
+        return os.path.join(self.directory, key + self.suffix)
+
+
+    def read(self, key, mode = 'rb'):
+        ''' Returns the content of the entry, or None if the key is not in the cache '''
+        try:
+            with open(self.entry(key), mode) as file:
+                content = file.read()
+            # Mark the entry as recently used
+            os.utime(self.entry(key))
+        except FileNotFoundError:
+            return None
+
+        return content
+
+
+    def write(self, key, content, mode = 'wb'):
+        '''
+        Stores the content of the entry. The directory is scanned to evict old entries
+        only the first time and when the size tracked since then goes over max_size
+        '''
+        os.makedirs(self.directory, exist_ok = True)
+
+        # Written aside and renamed, so concurrent processes never read half an entry
+        temp = f'{self.entry(key)}.{os.getpid()}.tmp'
+        with open(temp, mode) as file:
+            file.write(content)
+        os.replace(temp, self.entry(key))
+
+        if self.size is not None and self.size + len(content) <= self.max_size:
+            self.size += len(content)
+        else:
+            self.evict()
+
+
+    def evict(self):
+        ''' Removes the least recently used entries until they fit in max_size bytes, updating their size '''
+        os.makedirs(self.directory, exist_ok = True)
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self.size = size
+
+
+class AssemblyCache(FileCache):
+    '''
+    On-disk cache of ROM images, keyed by the hash of the assembly source.
+    Every entry is a file with the little-endian 16-bit words of the ROM.
+    Hits and misses are accumulated in stats.json inside the cache directory
+    '''
+
+    suffix = '.rom'
+
+    def __init__(self, directory = DEFAULT_DIR, max_size = DEFAULT_MAX_SIZE):
+        ''' Attributes: those of the FileCache, version of the assembler '''
+        FileCache.__init__(self, directory, max_size)
+        self.version = code_version()
+
+
+    def key(self, path, var_base = 16, optimize = 0):
+        ''' Returns the key of the assembly file: hash of its content and of the options, optimize being the level of the optimizer '''
+        digest = sha256(f'{self.version}:{var_base}:{optimize:d}:'.encode())
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+
+    def get(self, key):
+        ''' Returns the cached ROM image, or None if the key is not in the cache '''
+        data = self.read(key)
+        if data is None:
+            return None
+
+        rom = array('H')
+        rom.frombytes(data)
+        if byteorder == 'big':
+            rom.byteswap()
+
+        return rom
+
+
+    def put(self, key, rom):
+        ''' Stores the ROM image '''
+        if byteorder == 'big':
+            rom = array('H', rom)
+            rom.byteswap()
+
+        self.write(key, rom.tobytes())
+
+
+    def stats(self):
+        ''' Returns the accumulated statistics: hits, misses, entries and their size in bytes '''
+        try:
+            with open(os.path.join(self.directory, 'stats.json')) as file:
+                stats = json.load(file)
+        except (FileNotFoundError, ValueError):
+            stats = {'hits' : 0, 'misses' : 0}
+
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.rom')] \
+                  if os.path.isdir(self.directory) else []
+        stats['entries'] = len(entries)
+        stats['size'] = sum(entry.stat().st_size for entry in entries)
+        return stats
+
+
+    def record(self, hits, misses):
+        ''' Adds the hits and misses of a run to the accumulated statistics '''
+        stats = self.stats()
+        stats = {'hits' : stats['hits'] + hits, 'misses' : stats['misses'] + misses}
+        os.makedirs(self.directory, exist_ok = True)
+        temp = os.path.join(self.directory, f'stats.json.{os.getpid()}.tmp')
+        with open(temp, 'w') as file:
+            json.dump(stats, file)
+        os.replace(temp, os.path.join(self.directory, 'stats.json'))
@@ -0,0 +1,218 @@
+from assembly_tables import symbols_table
+
+# A push followed by a pop, or by the first half of a binary operation, as the VM
+# translator writes them: SP goes up and back down and D is read back from the top
+push_pops = [['@SP', 'AM=M+1', 'A=A-1', 'M=D', '@SP', 'AM=M-1', 'D=M'],
+             ['@SP', 'M=M+1', 'A=M-1', 'M=D', '@SP', 'AM=M-1', 'D=M']]
+
+# ... replaced by the store of D at the top: A, D, SP and the RAM end up the same
+push_pop_replacement = ['@SP', 'A=M', '', 'M=D', '', '', '']
+
+# A pop into the temp word N followed by its push: the reload leaves
+# A = N, D = RAM[N] and addr = N, as they already are after the pop
+temp_store_reload = ['@{N}', 'D=A', '@addr', 'M=D', '@SP', 'AM=M-1', 'D=M', '@addr', 'A=M', 'M=D',
+                     '@{N}', 'D=A', '@addr', 'AM=D', 'D=M']
+
+
+def pinned_lines(code):
+    '''
+    Returns the indexes of the first reference to every variable in the code.
+    They are never removed, so the variables keep their RAM addresses
+    '''
+    labels = {line[1:-1] for line in code if line[:1] == '('}
+    first_use = {}
+    for index, line in enumerate(code):
+        if line[:1] == '@':
+            symbol = line[1:]
+            if not symbol.isdigit() and symbol not in symbols_table and symbol not in labels:
+                first_use.setdefault(symbol, index)
+
+    return set(first_use.values())
+
+
+def numeric_jump_targets(code):
+    '''
+    Returns the numeric ROM addresses the code may jump to through D or RAM:
+    the values of @N copied into D (e.g. @8, D=A), like return addresses in code
+    without labels, if the code has a jump not right after an A-instruction.
+    Returns an empty set otherwise
+    '''
+    numeric_d = set()
+    computed_jump = False
+    previous = ''
+    for line in code:
+        if line == '':
+            continue
+        if ';' in line and previous[:1] != '@':
+            computed_jump = True
+        if previous[1:].isdigit() and '=' in line:
+            dest, comp = line.split(';')[0].split('=')
+            if 'D' in dest and 'A' in comp:
+                numeric_d.add(int(previous[1:]))
+        previous = line
+
+    return numeric_d if computed_jump else set()
+
+
+def first_changed_block(code, optimized):
+    '''
+    Returns the ROM address of the basic block where the optimized code starts to
+    differ from the code. A jump to a numeric address up to it still runs the same instructions
+    '''
+    address = start = 0
+    for line, optimized_line in zip(code, optimized):
+        if line != optimized_line:
+            return start
+        if line == '':
+            continue
+        if line[0] == '(':
+            start = address
+        else:
+            address += 1
+            if ';' in line:
+                start = address
+
+    return address
+
+
+def next_lines(code, index, n):
+    ''' Returns the indexes of the next n non empty lines from index, or None if a label or the end comes first '''
+    indexes = []
+    while len(indexes) < n:
+        if index >= len(code) or code[index][:1] == '(':
+            return None
+        if code[index] != '':
+            indexes.append(index)
+        index += 1
+
+    return indexes
+
+
+def rewrite_patterns(code, pinned):
+    '''
+    Rewrites in place the sequences of the VM translator that do useless work:
+    a push followed by a pop and a temp word reloaded after being stored.
+    Returns the number of instructions removed
+    '''
+    removed = 0
+    for index, line in enumerate(code):
+        if line == '@SP':
+            indexes = next_lines(code, index, len(push_pop_replacement))
+            if indexes is not None and [code[i] for i in indexes] in push_pops:
+                for i, replacement in zip(indexes, push_pop_replacement):
+                    code[i] = replacement
+                removed += 4
+
+        # The temp words are under RAM[16], so the pop can't have changed addr
+        elif line[1:].isdigit() and int(line[1:]) < 16:
+            indexes = next_lines(code, index, len(temp_store_reload))
+            pattern = [text.format(N = line[1:]) for text in temp_store_reload]
+            if indexes is not None and [code[i] for i in indexes] == pattern and pinned.isdisjoint(indexes[10:]):
+                for i in indexes[10:]:
+                    code[i] = ''
+                removed += 5
+
+    return removed
+
+
+def peephole_pass(code, pinned):
+    '''
+    Makes one pass over the cleaned code, blanking out the redundant instructions.
+    Returns the number of instructions removed, or None if the code
+    jumps to numeric ROM addresses, which would move
+    '''
+    removed = 0
+
+    # a_value: @value that A is known to hold
+    # d_mem: @value whose RAM word D is known to hold
+    # last_a: index of the previous instruction if it is an A-instruction
+    a_value = d_mem = last_a = None
+    for index, line in enumerate(code):
+        if line == '':
+            continue
+
+        # A label starts a new basic block: nothing is known about the registers
+        if line[0] == '(':
+            a_value = d_mem = last_a = None
+            continue
+
+        if line[0] == '@':
+            value = line[1:]
+            # An A-instruction loading the value A already holds
+            if value == a_value and index not in pinned:
+                code[index] = ''
+                removed += 1
+                continue
+            # An A-instruction overwritten by the next one
+            if last_a is not None and last_a not in pinned:
+                code[last_a] = ''
+                removed += 1
+            a_value, last_a = value, index
+            continue
+
+        last_a = None
+        jump = line.find(';')
+        instruction = line if jump == -1 else line[:jump]
+        index_eq = instruction.find('=')
+        dest = instruction[:index_eq] if index_eq != -1 else ''
+        comp = instruction[index_eq + 1:]
+
+        # D=M and M=D when D already holds the RAM word at A
+        if jump == -1 and d_mem is not None and d_mem == a_value and instruction in ('D=M', 'M=D'):
+            code[index] = ''
+            removed += 1
+            continue
+
+        # Effects of dest=comp: M is written at the address that A had before
+        if 'D' in dest and 'M' in dest:
+            d_mem = a_value
+        elif 'D' in dest:
+            d_mem = a_value if comp == 'M' else None
+        elif 'M' in dest:
+            d_mem = a_value if comp == 'D' else None
+        if 'A' in dest:
+            a_value = None
+
+        # A jump ends the basic block
+        if jump != -1:
+            if a_value is not None and a_value.isdigit() and a_value != '0':
+                return None
+            a_value = d_mem = None
+
+    return removed
+
+
+def peephole(code, symbolic = False):
+    '''
+    Removes provably redundant instructions from the cleaned assembly code,
+    working inside the basic blocks delimited by labels and jumps:
+        - @X immediately followed by another A-instruction
+        - @X when A already holds X (e.g. back-to-back @SP)
+        - D=M and M=D when D already holds the RAM word at A
+        - a push immediately followed by a pop, written by the VM translator
+        - the reload of a temp word just stored by the VM translator
+    The removed instructions are blanked out, so the other lines keep their position.
+    Returns (the code, number of instructions removed).
+    Code that jumps to numeric ROM addresses is returned unchanged, directly
+    or through D and RAM when the addresses could have moved. symbolic tells
+    that code addresses are only loaded through labels, as in the output of the
+    VM translator, so the numbers copied into D are never jumped to
+    '''
+    optimized = list(code)
+    pinned = pinned_lines(optimized)
+
+    removed = 0
+    while True:
+        removed_pass = rewrite_patterns(optimized, pinned)
+        removed_peephole = peephole_pass(optimized, pinned)
+        if removed_peephole is None:
+            return code, 0
+        if removed_pass + removed_peephole == 0:
+            break
+        removed += removed_pass + removed_peephole
+
+    targets = set() if symbolic or removed == 0 else numeric_jump_targets(code)
+    if targets and max(targets) > first_changed_block(code, optimized):
+        return code, 0
+
+    return optimized, removed
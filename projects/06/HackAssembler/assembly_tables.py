@@ -1,27 +1,29 @@
+from itertools import permutations
+
 symbols_table = {
-                'SP'     : '0',
-                'LCL'    : '1',
-                'ARG'    : '2',
-                'THIS'   : '3',
-                'THAT'   : '4',
-                'R0'     : '0',
-                'R1'     : '1',
-                'R2'     : '2',
-                'R3'     : '3',
-                'R4'     : '4',
-                'R5'     : '5',
-                'R6'     : '6',
-                'R7'     : '7',
-                'R8'     : '8',
-                'R9'     : '9',
-                'R10'    : '10',
-                'R11'    : '11',
-                'R12'    : '12',
-                'R13'    : '13',
-                'R14'    : '14',
-                'R15'    : '15',
-                'SCREEN' : '16384',
-                'KBD'    : '24576'
+                'SP'     : 0,
+                'LCL'    : 1,
+                'ARG'    : 2,
+                'THIS'   : 3,
+                'THAT'   : 4,
+                'R0'     : 0,
+                'R1'     : 1,
+                'R2'     : 2,
+                'R3'     : 3,
+                'R4'     : 4,
+                'R5'     : 5,
+                'R6'     : 6,
+                'R7'     : 7,
+                'R8'     : 8,
+                'R9'     : 9,
+                'R10'    : 10,
+                'R11'    : 11,
+                'R12'    : 12,
+                'R13'    : 13,
+                'R14'    : 14,
+                'R15'    : 15,
+                'SCREEN' : 16384,
+                'KBD'    : 24576
                 }
 
 # comp_table[0] when a = 0, comp_table[1] when a = 1
@@ -79,4 +81,36 @@ jump_table = {
              'JNE'  : '101',
              'JLE'  : '110',
              'JMP'  : '111'
-             }
\ No newline at end of file
+             }
+
+# The same tables pre-packed as ints, already shifted in their position
+# inside the 16-bit c-instruction: 111a cccc ccdd djjj
+C_PREFIX = 0b111 << 13
+
+comp_codes = {comp : int(bits, 2) << 6 for comp, bits in comp_table[0].items()}
+comp_codes.update({comp : (0b1000000 | int(bits, 2)) << 6 for comp, bits in comp_table[1].items()})
+
+dest_codes = {dest : int(bits, 2) << 3 for dest, bits in dest_table.items()}
+
+jump_codes = {jump : int(bits, 2) for jump, bits in jump_table.items()}
+
+# Commutative spellings of comp and every order of the dest registers are accepted too
+comp_aliases = {'A+D' : 'D+A', 'A&D' : 'D&A', 'A|D' : 'D|A',
+                'M+D' : 'D+M', 'M&D' : 'D&M', 'M|D' : 'D|M'}
+for alias, comp in comp_aliases.items():
+    comp_codes[alias] = comp_codes[comp]
+
+for dest in [dest for dest in dest_codes if dest != 'null']:
+    for registers in permutations(dest):
+        dest_codes[''.join(registers)] = dest_codes[dest]
+
+# Every valid c-instruction, as written without spaces in the source,
+# mapped to its 16-bit word: dest=comp;jump
+c_instructions = {}
+for comp, comp_bits in comp_codes.items():
+    for dest, dest_bits in dest_codes.items():
+        for jump, jump_bits in jump_codes.items():
+            text = comp if dest == 'null' else dest + '=' + comp
+            if jump != 'null':
+                text += ';' + jump
+            c_instructions[text] = C_PREFIX | comp_bits | dest_bits | jump_bits
@@ -0,0 +1,137 @@
+from os.path import abspath, dirname, join, basename
+from random import Random
+from sys import argv, version
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from assembly_tables import comp_codes, dest_codes, jump_codes
+from HackAssembler import Assembler
+
+PROJECTS = join(dirname(abspath(__file__)), '..', '..')
+
+# Real programs assembled by default
+REAL_INPUTS = [join(PROJECTS, '06', 'pong', 'Pong.asm'),
+               join(PROJECTS, '06', 'pong', 'PongL.asm'),
+               join(PROJECTS, '06', 'rect', 'Rect.asm')]
+
+
+def label_heavy(n, rng):
+    '''
+    Yields n lines of code with a label every two instructions. Only the
+    labels in the first 32K words can be loaded by an A-instruction, so they are the targets
+    '''
+    targets = min(n // 3, 16000)
+    for i in range(n // 3):
+        yield f'@LOOP_{rng.randrange(targets)}\n'
+        yield 'D;JNE\n'
+        yield f'(LOOP_{i})\n'
+
+
+def variable_heavy(n, rng):
+    ''' Yields n lines of code reading and writing a thousand different variables '''
+    for i in range(n // 2):
+        yield f'@var_{rng.randrange(1000)}\n'
+        yield 'M=D\n' if i % 2 else 'D=M\n'
+
+
+def c_heavy(n, rng):
+    ''' Yields n lines of C-instructions of every kind, with comments and spaces '''
+    comps, dests, jumps = sorted(comp_codes), sorted(dest_codes), sorted(jump_codes)
+    for i in range(n):
+        dest, comp, jump = rng.choice(dests), rng.choice(comps), rng.choice(jumps)
+        line = comp if dest == 'null' else f'{dest} = {comp}'
+        if jump != 'null':
+            line += f' ; {jump}'
+        yield line + ('   // comment\n' if i % 4 == 0 else '\n')
+
+
+generators = {'labels' : label_heavy, 'variables' : variable_heavy, 'c_instructions' : c_heavy}
+
+
+def measure(path, repeat):
+    '''
+    Assembles the file repeat times and returns the best time in seconds,
+    the number of words, and the peak memory in bytes of a separate traced run
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        rom = Assembler().assemble_file(path)
+        best = min(best, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    Assembler().assemble_file(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, len(rom), peak
+
+
+def run_case(name, path, repeat):
+    ''' Returns the results of the benchmark of a file as a dict '''
+    with open(path) as file:
+        n_lines = sum(1 for line in file)
+    seconds, n_words, peak = measure(path, repeat)
+
+    return {'name' : name,
+            'lines' : n_lines,
+            'words' : n_words,
+            'seconds' : round(seconds, 6),
+            'lines_per_second' : round(n_lines / seconds) if seconds else None,
+            'peak_memory_bytes' : peak}
+
+
+def run(sizes, inputs, repeat, seed):
+    ''' Runs every synthetic generator at every size and every real input. Returns the report '''
+    cases = []
+    with TemporaryDirectory() as directory:
+        for name, generator in generators.items():
+            for size in sizes:
+                path = join(directory, f'{name}_{size}.asm')
+                with open(path, 'w') as file:
+                    file.writelines(generator(size, Random(seed)))
+                cases.append(run_case(f'{name}_{size}', path, repeat))
+
+    for path in inputs:
+        cases.append(run_case(basename(path), path, repeat))
+
+    return {'python' : version.split()[0],
+            'platform' : platform.platform(),
+            'repeat' : repeat,
+            'seed' : seed,
+            'cases' : cases}
+
+
+def parse_args(args):
+    ''' Returns the parsed command line arguments '''
+    parser = argparse.ArgumentParser(prog = 'bench_assembler.py',
+                                     description = 'Benchmarks the Hack assembler, printing the results as JSON')
+    parser.add_argument('inputs', nargs = '*', default = REAL_INPUTS, metavar = 'file.asm',
+                        help = 'real programs to assemble (default: Pong and Rect of project 6)')
+    parser.add_argument('-s', '--sizes', type = int, nargs = '+', default = [10000, 100000],
+                        help = 'lines of the synthetic programs (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+                        help = 'runs of every case, the best time is reported (default: %(default)s)')
+    parser.add_argument('--seed', type = int, default = 0,
+                        help = 'seed of the synthetic programs (default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        help = 'write the JSON report in this file instead of the standard output')
+    return parser.parse_args(args)
+
+
+def main():
+    ''' Main function '''
+    args = parse_args(argv[1:])
+    report = json.dumps(run(args.sizes, args.inputs, args.repeat, args.seed), indent = 2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
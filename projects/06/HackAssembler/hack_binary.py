@@ -0,0 +1,83 @@
+# Compact binary form of a Hack ROM image (.hackb):
+#
+#     offset 0   magic            b'HACK'
+#     offset 4   version          uint16
+#     offset 6   header size      uint16 (offset of the first word)
+#     offset 8   number of words  uint32
+#     offset 12  reserved         uint32
+#     offset 16  words            uint16 each
+#
+# Every field is little-endian, so a .hackb file can be memory-mapped
+# and used as an array of 16-bit words without copying it
+
+from array import array
+from mmap import mmap, ACCESS_READ
+from sys import byteorder
+import struct
+
+MAGIC = b'HACK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+
+
+def write_hackb(rom, path):
+    ''' Writes the ROM image in a new file.hackb '''
+    if byteorder == 'big':
+        rom = array('H', rom)
+        rom.byteswap()
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, HEADER.size, len(rom), 0))
+        file.write(memoryview(rom).cast('B'))
+
+
+def read_header(data, path):
+    ''' Returns (offset of the first word, number of words) checking the header of the data '''
+    if len(data) < HEADER.size:
+        raise ValueError(f'{path}: too short for a .hackb header')
+
+    magic, version, header_size, n_words, reserved = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f'{path}: not a .hackb file')
+    if version != VERSION:
+        raise ValueError(f'{path}: unsupported .hackb version {version}')
+    if header_size + 2 * n_words > len(data):
+        raise ValueError(f'{path}: truncated, expected {n_words} words')
+
+    return header_size, n_words
+
+
+def load_hackb(path):
+    '''
+    Returns the words of the .hackb file as a read-only sequence of ints.
+    On little-endian machines it's a view on the memory-mapped file, without copies
+    '''
+    with open(path, 'rb') as file:
+        # mmap refuses empty files, which are not valid .hackb anyway
+        try:
+            data = mmap(file.fileno(), 0, access = ACCESS_READ)
+        except ValueError:
+            data = b''
+
+    start, n_words = read_header(data, path)
+    words = memoryview(data)[start:start + 2 * n_words]
+    if byteorder == 'little':
+        return words.cast('H')
+
+    rom = array('H', words.tobytes())
+    rom.byteswap()
+    return rom
+
+
+def read_hack(path):
+    ''' Returns the ROM image of the textual file.hack '''
+    with open(path) as file:
+        return array('H', (int(line, 2) for line in file if line.strip()))
+
+
+def load_rom(path):
+    ''' Returns the ROM image of a .hack or .hackb file '''
+    if path.endswith('.hackb'):
+        return load_hackb(path)
+
+    return read_hack(path)
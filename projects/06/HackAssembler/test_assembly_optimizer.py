@@ -0,0 +1,87 @@
+from os.path import abspath, dirname, join
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from HackAssembler import Assembler, clean_line
+from HackEmulator import Emulator
+from assembly_optimizer import peephole
+
+PROJECTS_DIR = join(dirname(abspath(__file__)), '..', '..')
+
+
+def cleaned(source):
+    ''' Returns the cleaned lines of the source '''
+    return [clean_line(line) for line in source.splitlines()]
+
+
+class PeepholeTest(unittest.TestCase):
+
+    def test_removes_repeated_a_instruction(self):
+        code, removed = peephole(cleaned('@SP\nD=M\n@SP\nM=D+1\n'))
+        self.assertEqual(removed, 1)
+        self.assertEqual([line for line in code if line], ['@SP', 'D=M', 'M=D+1'])
+
+
+    def test_keeps_numeric_address_jumped_to_through_d(self):
+        # @8 is the ROM address of @R2: removing the duplicate @R1 would move it
+        source = '@R1\n@R1\n@8\nD=A\n@R13\nM=D\nA=D\n0;JMP\n@R2\nM=1\n(END)\n@END\n0;JMP\n'
+        code, removed = peephole(cleaned(source))
+        self.assertEqual(removed, 0)
+        self.assertEqual(Assembler().assemble(code), Assembler().assemble(source))
+
+
+    def test_removes_reload_of_static(self):
+        # pop static 0, push static 0
+        source = '@SP\nAM=M-1\nD=M\n@Foo.0\nM=D\n@Foo.0\nD=M\n@SP\nM=M+1\nA=M-1\nM=D\n'
+        code, removed = peephole(cleaned(source), symbolic = True)
+        self.assertEqual(removed, 2)
+        self.assertEqual([line for line in code if line][3:6], ['@Foo.0', 'M=D', '@SP'])
+
+
+    def test_removes_push_followed_by_pop(self):
+        # push temp 0, pop static 1
+        source = '@5\nD=A\n@addr\nAM=D\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n@SP\nAM=M-1\nD=M\n@Foo.1\nM=D\n'
+        code, removed = peephole(cleaned(source), symbolic = True)
+        self.assertEqual(removed, 4)
+        self.assertEqual([line for line in code if line][5:], ['@SP', 'A=M', 'M=D', '@Foo.1', 'M=D'])
+
+
+    def test_removes_reload_of_temp(self):
+        # pop temp 2, push temp 2
+        source = ('@7\nD=A\n@addr\nM=D\n@SP\nAM=M-1\nD=M\n@addr\nA=M\nM=D\n'
+                  '@7\nD=A\n@addr\nAM=D\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n')
+        code, removed = peephole(cleaned(source), symbolic = True)
+        self.assertEqual(removed, 5)
+        self.assertEqual([line for line in code if line][10:], ['@SP', 'AM=M+1', 'A=A-1', 'M=D'])
+
+
+    def test_translator_output_runs_the_same(self):
+        # The registers, static variables and stack of the program at its final loop,
+        # R13 to R15 holding return addresses that move with the instructions removed
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copytree(join(PROJECTS_DIR, '08', 'FunctionCalls', 'StaticsTest'), join(directory, 'StaticsTest'))
+            subprocess.run([sys.executable, join(PROJECTS_DIR, '08', 'VMtranslator.py'), 'StaticsTest', '--no-cache'],
+                           cwd = directory, check = True, capture_output = True)
+            with open(join(directory, 'StaticsTest.asm')) as file:
+                code = [clean_line(line) for line in file]
+        finally:
+            shutil.rmtree(directory)
+
+        optimized, removed = peephole(code, symbolic = True)
+        self.assertGreater(removed, 0)
+        states = []
+        for lines in code, optimized:
+            emulator = Emulator(Assembler().assemble(lines))
+            emulator.run(100000)
+            self.assertTrue(emulator.halted)
+            ram = emulator.ram
+            states.append((ram[:13].tolist(), ram[16:ram[0]].tolist()))
+        self.assertEqual(states[0], states[1])
+        self.assertEqual(states[1][1][-2:], [-2 & 0xFFFF, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
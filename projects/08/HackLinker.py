@@ -0,0 +1,102 @@
+from sys import argv, exit
+from os.path import isdir, join
+from glob import glob
+from collections import Counter
+import argparse
+import re
+import time
+from VMbinary import Emitter, read_object, write_rom
+from VMtranslator import make_writer, write_init, write_shared_routines
+
+# The symbols left undefined by the CodeWriter are variables: static
+# variables FileName.i and the work variables of its routines
+static_variable = re.compile(r'[^.]+\.\d+$')
+work_variables = {'addr', 'end_frame'}
+
+
+def find_objects(paths):
+    ''' Returns the object modules in the paths: files, or the sorted .hobj files of directories '''
+    objects = []
+    for path in paths:
+        if isdir(path):
+            objects += sorted(glob(join(path, '*.hobj')))
+        else:
+            objects.append(path)
+
+    return objects
+
+
+def check_options(modules):
+    ''' Returns the options of the CodeWriter shared by all the modules, raises ValueError if they differ '''
+    options = modules[0]['options']
+    for module in modules[1:]:
+        if module['options'] != options:
+            raise ValueError(f"{module['name']} was translated with {module['options']}, "
+                             f"{modules[0]['name']} with {options}")
+
+    return options
+
+
+def link(modules):
+    '''
+    Returns the Emitter holding the linked program: the bootstrap if one of the
+    modules is Sys, the code of every module in order, then the shared routines
+    they need. Static variables are allocated from RAM[16] in order of first use.
+    Raises ValueError for a symbol defined twice or a function that is never defined
+    '''
+    options = check_options(modules)
+    emitter = Emitter()
+    counts = Counter()
+    if any(module['name'] == 'Sys' for module in modules):
+        writer = make_writer('Bootstrap', compact = options['compact'], shared = tuple(options['shared']))
+        emitter.write(write_init(writer))
+        counts.update(writer.counts)
+
+    for module in modules:
+        emitter.extend(module)
+        counts.update(module['counts'])
+    emitter.write(write_shared_routines(counts, options))
+
+    undefined = sorted({symbol for address, symbol in emitter.fixups
+                        if symbol not in emitter.labels and symbol not in work_variables
+                        and not static_variable.match(symbol)})
+    if undefined:
+        raise ValueError(f'undefined symbols: {", ".join(undefined)}')
+
+    emitter.link()
+    return emitter
+
+
+def parse_args(args):
+    ''' Returns the parsed command line arguments '''
+    parser = argparse.ArgumentParser(prog = 'HackLinker.py',
+                                     description = 'Links the object modules written by VMtranslator.py --object into Hack machine code')
+    parser.add_argument('paths', nargs = '+', metavar = 'fileName.hobj/directoryName',
+                        help = 'object modules, or directories of object modules, in the order of the program')
+    parser.add_argument('-o', '--output', required = True, metavar = 'program.hack/program.hackb',
+                        help = 'ROM image to write, as binary if it ends with .hackb')
+    return parser.parse_args(args)
+
+
+def main():
+    ''' Main function '''
+    args = parse_args(argv[1:])
+    start_time = time.perf_counter()
+
+    try:
+        objects = find_objects(args.paths)
+        if not objects:
+            raise ValueError('no object modules to link')
+        modules = [read_object(path) for path in objects]
+        emitter = link(modules)
+    except (OSError, ValueError) as error:
+        print(f'HackLinker: {error}')
+        exit(1)
+
+    write_rom(emitter.rom, args.output, 'hackb' if args.output.endswith('.hackb') else 'hack')
+    print(f'{args.output}: {len(modules)} modules, {len(emitter.rom)} words, '
+          f'{sum(1 for name in emitter.variables if static_variable.match(name))} static variables in {time.perf_counter() - start_time:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+from os.path import abspath, dirname, join
+from array import array
+import json
+import sys
+
+# The encoding tables and the writers of the ROM image are the ones of the assembler of project 6
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', '06', 'HackAssembler'))
+from assembly_tables import symbols_table, c_instructions
+from HackAssembler import A_translate, C_error, writers as rom_writers
+
+# Version of the format of the object modules
+OBJECT_VERSION = 2
+
+
+class Emitter(object):
+    '''
+    Encodes the Hack assembly written by the CodeWriter straight into 16-bit
+    words, one chunk at a time, without a text file assembled in a second pass.
+    Labels are recorded where they are defined; the A-instructions loading a
+    symbol are left as fixups and patched when the program is linked.
+    The chunks can be copied to a listing file as they are encoded
+    '''
+
+    def __init__(self, listing = None):
+        '''
+        Attributes: ROM image, addresses of the labels, (address, symbol)
+        of the words to patch, listing file or None, addresses of the variables once linked
+        '''
+        self.rom = array('H')
+        self.labels = {}
+        self.fixups = []
+        self.listing = listing
+        self.variables = {}
+
+
+    def write(self, asm):
+        ''' Encodes the chunk of assembly code written by a CodeWriter: one instruction or label per line '''
+        if self.listing is not None:
+            self.listing.write(asm)
+
+        rom, labels, fixups = self.rom, self.labels, self.fixups
+        for line in asm.split('\n'):
+            if line == '' or line[0] == '/':
+                continue
+
+            if line[0] == '(':
+                labels[line[1:-1]] = len(rom)
+            elif line[0] == '@':
+                value = line[1:]
+                if value.isdigit():
+                    rom.append(A_translate(int(value)))
+                elif value in symbols_table:
+                    rom.append(symbols_table[value])
+                else:
+                    fixups.append((len(rom), value))
+                    rom.append(0)
+            else:
+                word = c_instructions.get(line)
+                if word is None:
+                    raise ValueError(C_error(line))
+                rom.append(word)
+
+
+    def module(self):
+        '''
+        Returns the code written as a relocatable object module, JSON serializable:
+        its words, the labels it defines and the relocations (address, symbol)
+        of the words still to patch, all relative to its first word
+        '''
+        return {'code' : self.rom.tolist(), 'symbols' : self.labels, 'relocations' : self.fixups}
+
+
+    def extend(self, module):
+        ''' Appends the code of an object module, moving its labels and relocations after the words already written '''
+        base = len(self.rom)
+        for symbol, address in module['symbols'].items():
+            if symbol in self.labels:
+                raise ValueError(f'symbol {symbol} defined twice')
+            self.labels[symbol] = base + address
+
+        self.fixups += [(base + address, symbol) for address, symbol in module['relocations']]
+        self.rom.extend(module['code'])
+
+
+    def link(self, var_base = 16):
+        '''
+        Patches the fixups and returns the ROM image. Symbols that are not labels
+        are variables, allocated from var_base in order of first use like the assembler does
+        '''
+        rom, labels = self.rom, self.labels
+        self.variables = variables = {}
+        for address, symbol in self.fixups:
+            value = labels.get(symbol)
+            if value is None:
+                value = variables.setdefault(symbol, var_base + len(variables))
+            rom[address] = A_translate(value)
+
+        return rom
+
+
+def object_module(asm, name, options, counts):
+    '''
+    Returns the object module of the asm fragment translated from one vm file,
+    with its name, the options of the CodeWriter that must match in every module
+    linked together, and the counts of the calls, returns and shared comparisons
+    '''
+    emitter = Emitter()
+    emitter.write(asm)
+    module = emitter.module()
+    module.update({'version' : OBJECT_VERSION, 'name' : name, 'options' : options, 'counts' : counts})
+
+    return module
+
+
+def write_object(module, path):
+    ''' Writes the object module in a new file.hobj '''
+    with open(path, 'w') as file:
+        json.dump(module, file, separators = (',', ':'))
+
+
+def read_object(path):
+    ''' Returns the object module of the file.hobj '''
+    with open(path) as file:
+        module = json.load(file)
+    if module.get('version') != OBJECT_VERSION:
+        raise ValueError(f'{path}: unsupported object module version {module.get("version")}')
+
+    return module
+
+
+def write_rom(rom, path, out_format = 'hack'):
+    ''' Writes the ROM image in path, as text .hack or binary .hackb '''
+    rom_writers[out_format](rom, path)
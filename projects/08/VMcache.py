@@ -0,0 +1,59 @@
+from hashlib import sha256
+from os.path import dirname, abspath, join
+import json
+import os
+import sys
+
+# The cache of files is the one of the assembler of project 6
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', '06', 'HackAssembler'))
+from assembly_cache import FileCache, code_version
+
+# Directory of the python files of the translator
+SOURCE_DIR = dirname(abspath(__file__))
+
+
+class FragmentCache(FileCache):
+    '''
+    On-disk cache of the translations of single vm files, keyed by the hash of
+    the file, its name, the options and the version of the translator.
+    Every entry is an .asm fragment whose first line is a comment holding
+    the JSON data returned with it
+    '''
+
+    suffix = '.asm'
+
+    def __init__(self, directory, max_size):
+        '''
+        Attributes: those of the FileCache, version of the translator: the hash of
+        its python files, so fragments written by any other version are never returned
+        '''
+        FileCache.__init__(self, directory, max_size)
+        self.version = code_version(sorted(name for name in os.listdir(SOURCE_DIR) if name.endswith('.py')), SOURCE_DIR)
+
+
+    def key(self, path, options):
+        ''' Returns the key of the vm file: hash of its content, of its name and of the options (str) '''
+        digest = sha256(f'{self.version}:{os.path.basename(path)}:{options}:'.encode())
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+
+    def get(self, key):
+        ''' Returns (data, asm fragment) of the entry, or None if the key is not in the cache '''
+        content = self.read(key, 'r')
+        if content is None:
+            return None
+
+        line, newline, asm = content.partition('\n')
+        try:
+            return json.loads(line[2:]), asm
+        except ValueError:
+            return None
+
+
+    def put(self, key, data, asm):
+        ''' Stores the fragment with its JSON serializable data '''
+        self.write(key, '//' + json.dumps(data) + '\n' + asm, 'w')
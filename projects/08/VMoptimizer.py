@@ -0,0 +1,177 @@
+from sys import argv, exit
+from os import listdir, makedirs
+from os.path import isfile, isdir, basename, dirname, join
+import argparse
+from VMparser import Command, parse_vm
+
+# Functions of the binary arithmetic commands on 16-bit two's complement values.
+# Comparisons look at the sign of x - y, exactly as the translated code does
+binary_table = { 'add' : lambda x, y: x + y,
+                 'sub' : lambda x, y: x - y,
+                 'and' : lambda x, y: x & y,
+                 'or'  : lambda x, y: x | y,
+                 'eq'  : lambda x, y: -1 if to_signed(x - y) == 0 else 0,
+                 'gt'  : lambda x, y: -1 if to_signed(x - y) > 0 else 0,
+                 'lt'  : lambda x, y: -1 if to_signed(x - y) < 0 else 0 }
+
+# Functions of the unary arithmetic commands
+unary_table = { 'neg' : lambda x: -x,
+                'not' : lambda x: ~x }
+
+# Commands that cancel out when they follow themselves
+involutions = ['not', 'neg']
+
+# Binary commands whose right operand 0 leaves the left one unchanged
+zero_identities = ['add', 'sub', 'or']
+
+
+def to_signed(value):
+    ''' Returns the 16-bit two's complement value as a signed int '''
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def constant(command):
+    ''' Returns the value pushed by a push constant command, or None for any other command '''
+    if command.op == 'push' and command.arg1 == 'constant':
+        return command.arg2
+
+    return None
+
+
+def constant_at(commands, i):
+    '''
+    Returns (value, number of commands) of the constant pushed by the commands
+    starting at commands[i]: push constant x, optionally followed by neg or not.
+    Returns None if they don't push a constant
+    '''
+    x = constant(commands[i]) if i < len(commands) else None
+    if x is None:
+        return None
+
+    if i + 1 < len(commands) and commands[i + 1].op in unary_table:
+        return to_signed(unary_table[commands[i + 1].op](x)), 2
+
+    return x, 1
+
+
+def push_value(value):
+    ''' Returns the shortest list of commands pushing the 16-bit value '''
+    value = to_signed(value)
+    if value >= 0:
+        return [Command('push', 'constant', value)]
+    if value == -32768:
+        return [Command('push', 'constant', 32767), Command('not')]
+
+    return [Command('push', 'constant', -value), Command('neg')]
+
+
+def rewrite(commands, i):
+    '''
+    Returns (number of commands, replacement) for a pattern starting
+    at commands[i] that can be simplified, or None
+    '''
+    first = commands[i]
+    second = commands[i + 1] if i + 1 < len(commands) else None
+    x = constant(first)
+
+    # Constants x and y, then a binary op -> constant (x op y)
+    # Constant x, then an unary op -> constant (op x)
+    x_constant = constant_at(commands, i)
+    if x_constant is not None:
+        x_value, x_length = x_constant
+        y_constant = constant_at(commands, i + x_length)
+        if y_constant is not None:
+            y_value, y_length = y_constant
+            length = x_length + y_length + 1
+            if i + length - 1 < len(commands) and commands[i + length - 1].op in binary_table:
+                folded = push_value(binary_table[commands[i + length - 1].op](x_value, y_value))
+                if len(folded) < length:
+                    return length, folded
+
+        if i + x_length < len(commands) and commands[i + x_length].op in unary_table:
+            folded = push_value(unary_table[commands[i + x_length].op](x_value))
+            if len(folded) < x_length + 1:
+                return x_length + 1, folded
+
+    # push constant 0, add/sub/or -> nothing
+    if x == 0 and second is not None and second.op in zero_identities:
+        return 2, []
+
+    # not, not and neg, neg -> nothing
+    if first.op in involutions and second == first:
+        return 2, []
+
+    # push segment i, pop segment i -> nothing
+    if first.op == 'push' and x is None and second is not None and second.op == 'pop' and second[1:] == first[1:]:
+        return 2, []
+
+    return None
+
+
+def optimize(commands):
+    '''
+    Returns the optimized list of commands, rewriting the patterns
+    until none is left: constant folding, algebraic identities
+    and pushes immediately popped back to the same place
+    '''
+    changed = True
+    while changed:
+        changed = False
+        optimized = []
+        i = 0
+        while i < len(commands):
+            match = rewrite(commands, i)
+            if match is None:
+                optimized.append(commands[i])
+                i += 1
+            else:
+                optimized.extend(match[1])
+                i += match[0]
+                changed = True
+        commands = optimized
+
+    return commands
+
+
+def write_vm(commands, path):
+    ''' Writes the commands in a new file.vm '''
+    with open(path, 'w') as vm_file:
+        vm_file.writelines(str(command) + '\n' for command in commands)
+
+
+def parse_args(args):
+    ''' Returns the parsed command line arguments '''
+    parser = argparse.ArgumentParser(prog = 'VMoptimizer.py',
+                                     description = 'Optimizes VM code, writing the optimized .vm files')
+    parser.add_argument('path', metavar = 'fileName.vm/directoryName')
+    parser.add_argument('-o', '--output',
+                        help = 'directory of the optimized files (default: "optimized" next to the input files)')
+    return parser.parse_args(args)
+
+
+def main():
+    ''' Main function '''
+    args = parse_args(argv[1:])
+
+    if isfile(args.path):
+        paths = [args.path]
+        output = args.output or join(dirname(args.path), 'optimized')
+    elif isdir(args.path):
+        paths = [join(args.path, vm) for vm in listdir(args.path) if '.vm' in vm]
+        output = args.output or join(args.path, 'optimized')
+    else:
+        print(f'{args.path}: no such file or directory')
+        exit(1)
+
+    makedirs(output, exist_ok = True)
+    for path in paths:
+        with open(path) as vm_file:
+            commands = parse_vm(vm_file)
+        optimized = optimize(commands)
+        write_vm(optimized, join(output, basename(path)))
+        print(f'{basename(path)}: {len(commands)} -> {len(optimized)} commands')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+
+class Command(namedtuple('Command', ['op', 'arg1', 'arg2'], defaults = [None, None])):
+    '''
+    A parsed vm command: operation, first argument and second argument,
+    which is always an int, e.g. Command('push', 'constant', 2)
+    '''
+
+    __slots__ = ()
+
+    def __str__(self):
+        ''' Returns the command as a line of vm code '''
+        if self.arg2 is not None:
+            return f'{self.op} {self.arg1} {self.arg2}'
+        elif self.arg1 is not None:
+            return f'{self.op} {self.arg1}'
+
+        return self.op
+
+
+def clean_line(line):
+    ''' Removes comments and surrounding whitespace '''
+    index = line.find('//')
+    if index != -1:
+        line = line[:index]
+
+    return line.strip()
+
+
+def parse_command(line):
+    ''' Returns the Command of a cleaned, non empty line of vm code '''
+    words = line.split()
+    if len(words) == 3:
+        words[2] = int(words[2])
+    else:
+        words += [None] * (3 - len(words))
+
+    return Command._make(words)
+
+
+def parse_vm(lines):
+    ''' Returns the IR of the vm code: the list of its Commands, each line split only once '''
+    return [parse_command(line) for line in map(clean_line, lines) if line != '']
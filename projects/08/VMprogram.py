@@ -0,0 +1,129 @@
+from collections import Counter
+from VMparser import Command
+
+# Change of the height of the stack for the commands of an inlinable function
+stack_effects = { 'push' : 1, 'pop' : -1,
+                  'add' : -1, 'sub' : -1, 'and' : -1, 'or' : -1, 'eq' : -1, 'gt' : -1, 'lt' : -1,
+                  'neg' : 0, 'not' : 0 }
+
+
+def split_functions(commands):
+    '''
+    Yields (functionName, commands) for every function of the list of Commands,
+    in order. The commands before the first function belong to the function ''
+    '''
+    name, start = '', 0
+    for i, command in enumerate(commands):
+        if command.op == 'function':
+            if i > start or name != '':
+                yield name, commands[start:i]
+            name, start = command.arg1, i
+
+    if len(commands) > start or name != '':
+        yield name, commands[start:]
+
+
+def inlinable(body):
+    '''
+    Returns True if the function can be inlined: a straight line of push, pop
+    and arithmetic commands ending with its only return. Static variables
+    belong to the file of the function, so it must not use them
+    '''
+    return len(body) >= 2 and body[0].op == 'function' and body[-1].op == 'return' and \
+           all(command.op in stack_effects and command.arg1 != 'static' for command in body[1:-1])
+
+
+def summarize(commands):
+    '''
+    Returns the summary of the list of Commands, as JSON serializable data:
+    {functionName : {'calls' : counts of the called functions,
+                     'operations' : counts of the operations,
+                     'body' : lines of the function, only if it is inlinable}}
+    '''
+    summary = {}
+    for name, body in split_functions(commands):
+        summary[name] = {'calls' : Counter(command.arg1 for command in body if command.op == 'call'),
+                         'operations' : Counter(command.op for command in body)}
+        if inlinable(body):
+            summary[name]['body'] = [str(command) for command in body]
+
+    return summary
+
+
+def reachable(summaries, roots, inlined = ()):
+    '''
+    Returns the set of functions reachable from the roots through the call graph
+    of the summaries, where the calls of the inlined functions are no longer edges.
+    The code before the first function of every file is always reachable
+    '''
+    calls = {}
+    for summary in summaries:
+        for name, function in summary.items():
+            calls[name] = function['calls']
+
+    stack = list(roots) + ['']
+    found = set(stack)
+    while stack:
+        for callee in calls.get(stack.pop(), []):
+            if callee not in found and callee not in inlined:
+                found.add(callee)
+                stack.append(callee)
+
+    return found
+
+
+def remove_functions(commands, removed):
+    ''' Returns the list of Commands without the functions in removed '''
+    if not removed:
+        return commands
+
+    return [command for name, body in split_functions(commands) if name not in removed for command in body]
+
+
+def inline_body(body, n_args):
+    '''
+    Returns the commands replacing a call with n_args arguments of the inlinable
+    function body. The arguments stay on the stack, followed by the locals and by
+    THIS and THAT if the function changes them: all of them are addressed with
+    the pseudo segment stack, whose index i is the word at SP - i. On return the
+    result takes the place of the first argument and the rest is dropped
+    '''
+    n_locals = body[0].arg2
+    saved = sorted({command.arg2 for command in body if command.op == 'pop' and command.arg1 == 'pointer'})
+    inlined = [Command('push', 'constant', 0)] * n_locals + [Command('push', 'pointer', i) for i in saved]
+
+    # Slot of the first argument and of the first local, counted from the bottom of the frame
+    base = {'argument' : 0, 'local' : n_args}
+    height = n_args + n_locals + len(saved)
+    for command in body[1:-1]:
+        if command.arg1 in base and command.op == 'push':
+            inlined.append(Command('push', 'stack', height - base[command.arg1] - command.arg2))
+        elif command.arg1 in base:
+            inlined.append(Command('pop', 'stack', height - 1 - base[command.arg1] - command.arg2))
+        else:
+            inlined.append(command)
+        height += stack_effects[command.op]
+
+    for slot, i in enumerate(saved, n_args + n_locals):
+        inlined += [Command('push', 'stack', height - slot), Command('pop', 'pointer', i)]
+    if height > 1:
+        inlined.append(Command('pop', 'stack', height - 1))
+    if height > 2:
+        inlined.append(Command('drop', 'stack', height - 2))
+
+    return inlined
+
+
+def inline_calls(commands, bodies):
+    ''' Returns the list of Commands with the calls of the functions in bodies {functionName : body} inlined '''
+    if not bodies:
+        return commands
+
+    inlined = []
+    for command in commands:
+        if command.op == 'call' and command.arg1 in bodies:
+            inlined += inline_body(bodies[command.arg1], command.arg2)
+        else:
+            inlined.append(command)
+
+    return inlined
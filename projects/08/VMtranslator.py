@@ -1,320 +1,976 @@
-from sys import exit, argv
+from sys import argv
 from os import listdir
-from os.path import isfile
-
-# Command table for command_type function
-command_tab = { 'push'     : 'C_PUSH',
-                'pop'      : 'C_POP',
-                'label'    : 'C_LABEL',
-                'if-goto'  : 'C_IF',
-                'goto'     : 'C_GOTO',
-                'function' : 'C_FUNCTION',
-                'call'     : 'C_CALL',
-                'return'   : 'C_RETURN' }
-
-def command_type(command):
-    ''' Returns a string representing the type of the command '''
-    if command in C_ARITHMETIC.arithmetic_table:
-        return 'C_ARITHMETIC'
-    else:
-        return command_tab[command.split(' ')[0]]
+from os.path import isfile, basename, join, splitext, normpath, expanduser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import argparse
+import json
+from VMparser import Command, parse_vm
+from VMoptimizer import optimize
+from VMprogram import summarize, reachable, remove_functions, inline_body, inline_calls
+
+# Words of the Hack ROM
+ROM_SIZE = 32768
+
+# The cache of fragments and the machine code use modules of the assembler of project 6:
+# they are only imported with the cache, --emit or --object
+DEFAULT_CACHE_DIR = join(expanduser('~'), '.cache', 'VMtranslator')
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+ROM_FORMATS = ['hack', 'hackb']
+
+# Base pointers of the segments addressed through them
+segment_pointers = {'argument' : 'ARG', 'local' : 'LCL', 'this' : 'THIS', 'that' : 'THAT'}
+
+
+def push_segment(pointer):
+    ''' Returns the format function of push for the segment with the given base pointer '''
+    return lambda i, static: f'@{i}\nD=A\n@{pointer}\nD=D+M\n@addr\nAM=D\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n'
+
+
+def pop_segment(pointer):
+    ''' Returns the format function of pop for the segment with the given base pointer '''
+    return lambda i, static: f'@{i}\nD=A\n@{pointer}\nD=D+M\n@addr\nM=D\n@SP\nAM=M-1\nD=M\n@addr\nA=M\nM=D\n'
+
+
+def stack_address(i):
+    ''' Returns: A = SP - i. Large indexes are subtracted, using D '''
+    if i == 0:
+        return '@SP\nA=M\n'
+    elif i <= 3:
+        return '@SP\nA=M-1\n' + 'A=A-1\n' * (i - 1)
 
+    return f'@SP\nD=M\n@{i}\nA=D-A\n'
 
-def clean_line(line):
-    ''' Removes comments if existing '''
-    try:
-        return line[:line.index('/')].replace('\n', '').strip()
-    except ValueError:
-        return line.replace('\n', '')
 
+def pop_stack(i, static):
+    ''' Returns the pop into the word i under the top of the stack left by the pop '''
+    if i <= 7:
+        return '@SP\nAM=M-1\nD=M\n' + 'A=A-1\n' * i + 'M=D\n'
 
-class C_MEMORY(object):
-    ''' Class of memory commands '''
+    return f'@SP\nD=M\n@{i + 1}\nD=D-A\n@R13\nM=D\n@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n'
 
-    segment = {'argument' : 'ARG', 'local' : 'LCL', 'this' : 'THIS', 'that' : 'THAT'}
 
-    def __init__(self, command):
+# Format functions of push and pop for every segment, taking the index
+# and the prefix of the static variables of the file. The pseudo segment
+# stack, used by inlined functions, is the word at SP - index
+push_table = { 'constant' : lambda i, static: f'@{i}\nD=A\n@SP\nM=M+1\nA=M-1\nM=D\n',
+               'static'   : lambda i, static: f'@{static}{i}\nD=M\n@SP\nM=M+1\nA=M-1\nM=D\n',
+               'pointer'  : lambda i, static: f'@{pointer_names[i]}\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n',
+               'temp'     : lambda i, static: f'@{5 + i}\nD=A\n@addr\nAM=D\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n',
+               'stack'    : lambda i, static: stack_address(i) + 'D=M\n@SP\nAM=M+1\nA=A-1\nM=D\n',
+               **{segment : push_segment(pointer) for segment, pointer in segment_pointers.items()} }
+
+pop_table = { 'static'  : lambda i, static: f'@SP\nAM=M-1\nD=M\n@{static}{i}\nM=D\n',
+              'pointer' : lambda i, static: f'@SP\nAM=M-1\nD=M\n@{pointer_names[i]}\nM=D\n',
+              'temp'    : lambda i, static: f'@{5 + i}\nD=A\n@addr\nM=D\n@SP\nAM=M-1\nD=M\n@addr\nA=M\nM=D\n',
+              'stack'   : pop_stack,
+              **{segment : pop_segment(pointer) for segment, pointer in segment_pointers.items()} }
+
+# Registers of pointer 0 and pointer 1
+pointer_names = ('THIS', 'THAT')
+
+
+def compare(jump):
+    ''' Returns the format function of the comparison, taking its unique label '''
+    return lambda label: f'@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@{label}\nD;{jump}\n@SP\nA=M-1\nM=0\n({label})\n'
+
+
+# Format functions of the arithmetic commands, taking a unique label for the comparisons
+compare_jumps = {'eq' : 'JEQ', 'gt' : 'JGT', 'lt' : 'JLT'}
+arithmetic_table = { 'add' : lambda label: '@SP\nAM=M-1\nD=M\nA=A-1\nM=M+D\n',
+                     'sub' : lambda label: '@SP\nAM=M-1\nD=M\nA=A-1\nM=M-D\n',
+                     'neg' : lambda label: '@SP\nA=M-1\nM=-M\n',
+                     'and' : lambda label: '@SP\nAM=M-1\nD=M\nA=A-1\nM=D&M\n',
+                     'or'  : lambda label: '@SP\nAM=M-1\nD=M\nA=A-1\nM=D|M\n',
+                     'not' : lambda label: '@SP\nA=M-1\nM=!M\n',
+                     **{command : compare(jump) for command, jump in compare_jumps.items()} }
+
+
+class CodeWriter(object):
+    '''
+    Translates the commands of a vm file, dispatching each
+    one to the writer of its operation. All the state is kept
+    in the instance and the labels it generates start with the
+    name of the file, so every file can be translated on its own
+    '''
+
+    # Count the instructions saved by every shared comparison
+    measure_sites = True
+
+    def __init__(self, file_name, compact = False, shared = (), fuse_moves = False, tail_calls = False, sizes = False):
         '''
-        Attributes: arg1 = segment, arg2 = i
-        segment = (argument, local, this, that),
-        static, constant,  pointer, temp
+        Options:
+        compact: every call jumps to the shared $CALL routine
+        shared: comparisons translated as jumps to a shared routine
+        fuse_moves: a push immediately followed by a pop is translated as a direct move
+        tail_calls: a call immediately followed by a return reuses the frame of the function
+        sizes: count the instructions of every function and operation
+
+        Attributes: name of the file, prefix of its static variables,
+        name of the current function, unique id of the generated labels,
+        counts of the calls, returns and shared comparisons and of the
+        instructions saved by the shared comparisons, instructions
+        of every (function, operation) or None, writers of every operation
         '''
-        self.arg1 = command.split()[1]
-        self.arg2 = command.split()[2]
-
-
-class C_POP(C_MEMORY):
-    ''' Class of pop commands '''
-
-    pop_table = { 'segment' : '@i\nD=A\n@segmentPointer\nD=D+M\n@addr\nM=D\n@SP\nAM=M-1\nD=M\n@addr\nA=M\nM=D\n',
-                  'static'  : '@SP\nAM=M-1\nD=M\n@file.i\nM=D\n',
-                  'pointer' : '@SP\nAM=M-1\nD=M\n@THIS/THAT\nM=D\n',
-                  'temp'    : '@5+i\nD=A\n@addr\nM=D\n@SP\nAM=M-1\nD=M\n@addr\nA=M\nM=D\n' }
-
-    def __init__(self, command, file_name):
-        C_MEMORY.__init__(self, command)
-        self.file_name = file_name
-
-    def write_pop(self):
-        ''' Translates the pop command in assembly '''
-        if self.arg1 in C_MEMORY.segment:
-            return C_POP.pop_table['segment'].replace('@i', '@' + self.arg2).replace('segmentPointer', C_MEMORY.segment[self.arg1])
-        elif self.arg1 == 'static':
-            return C_POP.pop_table['static'].replace('file.i', self.file_name.strip('vm') + self.arg2)
-        elif self.arg1 == 'temp':
-            return C_POP.pop_table['temp'].replace('5+i', str(5 + int(self.arg2)))
-        elif self.arg1 == 'pointer':
-            if self.arg2 == '0':
-                return C_POP.pop_table['pointer'].replace('THIS/THAT', 'THIS')
+        self.compact = compact
+        self.shared = shared
+        self.fuse_moves = fuse_moves
+        self.tail_calls = tail_calls
+        self.name = splitext(file_name)[0]
+        self.static = self.name + '.'
+        self.function = ''
+        self.label_id = 0
+        self.counts = Counter()
+        self.sizes = Counter() if sizes else None
+        self.writers = { 'push'     : self.write_push,
+                         'pop'      : self.write_pop,
+                         'label'    : self.write_label,
+                         'if-goto'  : self.write_if,
+                         'goto'     : self.write_goto,
+                         'function' : self.write_function,
+                         'call'     : self.write_call,
+                         'return'   : self.write_return,
+                         'drop'     : self.write_drop,
+                         **{command : self.write_arithmetic for command in arithmetic_table} }
+
+
+    def translate(self, commands):
+        ''' Yields the translation of every command, preceded by the command as a comment '''
+        writers = self.writers
+        i = 0
+        while i < len(commands):
+            command = commands[i]
+            if command.op in self.shared and self.measure_sites:
+                self.counts[command.op + '_saving'] += self.site_saving(commands, i)
+            if self.fuse_moves and command.op == 'push' and i + 1 < len(commands) and commands[i + 1].op == 'pop':
+                asm, kind, step = f'// {command}\n// {commands[i + 1]}\n' + self.write_move(command, commands[i + 1]), 'push+pop', 2
+            elif self.tail_calls and command.op == 'call' and i + 1 < len(commands) and commands[i + 1].op == 'return':
+                asm, kind, step = f'// {command}\n// {commands[i + 1]}\n' + self.write_tail_call(command), 'tail call', 2
             else:
-                return C_POP.pop_table['pointer'].replace('THIS/THAT', 'THAT')
-
-class C_PUSH(C_MEMORY):
-    ''' Class of push commands '''
-
-    push_table = {'constant' : '@i\nD=A\n@SP\nM=M+1\nA=M-1\nM=D\n',
-                  'segment'  : '@i\nD=A\n@segmentPointer\nD=D+M\n@addr\nAM=D\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n',
-                  'static'   : '@file.i\nD=M\n@SP\nM=M+1\nA=M-1\nM=D\n',
-                  'pointer'  : '@THIS/THAT\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n',
-                  'temp'     : '@5+i\nD=A\n@addr\nAM=D\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' }
-
-    def __init__(self, command, file_name):
-        C_MEMORY.__init__(self, command)
-        self.file_name = file_name
-
-    def write_push(self):
-        ''' Translates the push command in assembly '''
-        if self.arg1 == 'constant':
-            return C_PUSH.push_table['constant'].replace('@i', '@' + self.arg2)
-        elif self.arg1 in C_MEMORY.segment:
-            return C_PUSH.push_table['segment'].replace('@i', '@' + self.arg2).replace('segmentPointer', C_MEMORY.segment[self.arg1])
-        elif self.arg1 == 'static':
-            return C_PUSH.push_table['static'].replace('file.i', self.file_name.strip('vm') + self.arg2)
-        elif self.arg1 == 'temp':
-            return C_PUSH.push_table['temp'].replace('5+i', str(5 + int(self.arg2)))
-        elif self.arg1 == 'pointer':
-            if self.arg2 == '0':
-                return C_PUSH.push_table['pointer'].replace('THIS/THAT', 'THIS')
-            else:
-                return C_PUSH.push_table['pointer'].replace('THIS/THAT', 'THAT')
-
+                asm, kind, step = f'// {command}\n' + writers[command.op](command), command.op, 1
 
-class C_ARITHMETIC(object):
-    ''' Class of arithmetic commands '''
+            if self.sizes is not None:
+                self.sizes[self.function, kind] += count_instructions(asm)
+            yield asm
+            i += step
 
-    # variable for unique labels
-    x = 0
-    arithmetic_table = { 'add' : '@SP\nAM=M-1\nD=M\nA=A-1\nM=M+D\n',
-                         'sub' : '@SP\nAM=M-1\nD=M\nA=A-1\nM=M-D\n',
-                         'neg' : '@SP\nA=M-1\nM=-M\n',
-                         'eq'  : '@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@END_EQx\nD;JEQ\n@SP\nA=M-1\nM=0\n(END_EQx)\n',
-                         'gt'  : '@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@END_GTx\nD;JGT\n@SP\nA=M-1\nM=0\n(END_GTx)\n',
-                         'lt'  : '@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@END_LTx\nD;JLT\n@SP\nA=M-1\nM=0\n(END_LTx)\n',
-                         'and' : '@SP\nAM=M-1\nD=M\nA=A-1\nM=D&M\n',
-                         'or'  : '@SP\nAM=M-1\nD=M\nA=A-1\nM=D|M\n',
-                         'not' : '@SP\nA=M-1\nM=!M\n' }
 
-    def __init__(self, command):
-        ''' Attribute: arithmetic command '''
-        self.command = command
+    def site_saving(self, commands, i):
+        ''' Returns the instructions saved by translating the comparison commands[i] as a jump to the shared routine '''
+        op = commands[i].op
+        return count_instructions(arithmetic_table[op]('end')) - count_instructions(write_shared_compare(op, 'ret'))
 
-    def write_arithmetic(self):
-        ''' Translates the arithmetic command in assembly '''
-        C_ARITHMETIC.x += 1
-        return C_ARITHMETIC.arithmetic_table[self.command].replace('x', str(C_ARITHMETIC.x))
 
+    def write_push(self, command):
+        return push_table[command.arg1](command.arg2, self.static)
 
-class C_LABEL(object):
-    ''' Class of label commands '''
 
-    def __init__(self, label, f_name):
-        ''' Attribute: label , functionName'''
-        self.label = label.split()[1]
-        self.f_name = f_name
+    def write_pop(self, command):
+        return pop_table[command.arg1](command.arg2, self.static)
 
-    def write_label(self):
-        return f'({self.f_name}${self.label}{str(C_CALL.id)})\n'
 
+    def unique_label(self, name):
+        ''' Returns a label of the file never returned before: fileName$nameN '''
+        self.label_id += 1
+        return f'{self.name}${name}{self.label_id}'
 
-class C_IF(object):
-    ''' Class of if-goto commands '''
 
-    def __init__(self, label, f_name):
-        ''' Attribute: label , functionName'''
-        self.label = label.split()[1]
-        self.f_name = f_name
+    def write_arithmetic(self, command):
+        if command.op in self.shared:
+            self.counts[command.op] += 1
+            return write_shared_compare(command.op, self.unique_label('RET_' + command.op.upper()))
+        elif command.op in compare_jumps:
+            return arithmetic_table[command.op](self.unique_label('END_' + command.op.upper()))
 
-    def write_if(self):
-        return '@SP\nAM=M-1\nD=M\n' +\
-               '@' + self.f_name + '$' + self.label + str(C_CALL.id) + '\nD;JNE\n'
+        return arithmetic_table[command.op](None)
 
 
-class C_GOTO(object):
-    ''' Class of unconditional goto commands '''
+    def write_label(self, command):
+        return f'({self.function}${command.arg1})\n'
 
-    def __init__(self, label, f_name):
-        ''' Attribute: label , functionName'''
-        self.label = label.split()[1]
-        self.f_name = f_name
 
-    def write_goto(self):
-        return '@' + self.f_name + '$' + self.label + str(C_CALL.id) + '\n0;JMP\n'
+    def write_if(self, command):
+        return f'@SP\nAM=M-1\nD=M\n@{self.function}${command.arg1}\nD;JNE\n'
 
 
-class C_FUNCTION(object):
-    ''' Class of function commands '''
+    def write_goto(self, command):
+        return f'@{self.function}${command.arg1}\n0;JMP\n'
 
-    def __init__(self, command):
-        ''' Attributes: functionName, nVars'''
-        self.f_name = command.split()[1]
-        self.n_vars = int(command.split()[2])
 
-    def write_function(self):
+    def write_function(self, command):
         '''
         Returns: (functionName)
-                 repeat n_vars times:
+                 repeat nVars times:
                      push 0
         '''
-        return '(' + self.f_name + ')' + '\n' +\
-               '@SP\nM=M+1\nA=M-1\nM=0\n' * self.n_vars
+        self.function = command.arg1
+        return f'({command.arg1})\n' + '@SP\nM=M+1\nA=M-1\nM=0\n' * command.arg2
+
+
+    def write_call(self, command):
+        self.counts['call'] += 1
+        return_address = self.unique_label(f'return_address_{command.arg1}_')
+        if self.compact:
+            return write_compact_call(command.arg1, command.arg2, return_address)
+
+        return write_inline_call(command.arg1, command.arg2, return_address)
+
 
+    def write_return(self, command):
+        self.counts['return'] += 1
+        if self.compact:
+            return '@$RETURN\n0;JMP\n'
 
-class C_CALL(object):
-    ''' Class of call function commands '''
+        return write_inline_return()
 
-    # Unique id for labels and return addresses of functions
-    id = 0
 
-    def __init__(self, command):
-        ''' Attributes: functionName, nArgs, returnAddress '''
-        self.f_name = command.split()[1]
-        self.n_args = command.split()[2]
-        C_CALL.id += 1
+    def write_drop(self, command):
+        ''' Removes arg2 words from the top of the stack, for inlined functions '''
+        if command.arg2 == 1:
+            return '@SP\nM=M-1\n'
 
-    def write_call(self):
+        return f'@{command.arg2}\nD=A\n@SP\nM=M-D\n'
+
+
+    def write_tail_call(self, command):
+        '''
+        Returns the call of a function whose result is returned right away,
+        reusing the frame of the current function, so the stack doesn't grow.
+        The callee returns straight to the caller of the current function.
+        If the saved frame is already where the new one goes (ARG + nArgs + 5 = LCL,
+        e.g. a function calling itself) only the arguments are copied to ARG:
+            copy the nArgs arguments to ARG, SP = LCL, goto functionName
+        Otherwise the saved frame is moved with them:
+            push *(LCL - 5) ... *(LCL - 1) above the arguments,
+            copy these nArgs + 5 words to ARG, LCL = SP = ARG + nArgs + 5, goto functionName
+        '''
+        self.counts['tail_call'] += 1
+        n_args, same_frame = command.arg2, self.unique_label('TAIL_CALL_')
+        return f'@ARG\nD=M\n@{n_args + 5}\nD=D+A\n@LCL\nD=D-M\n@{same_frame}\nD;JEQ\n' +\
+               '@LCL\nD=M\n@6\nD=D-A\n@R13\nM=D\n' +\
+               '@R13\nAM=M+1\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' * 5 +\
+               f'@SP\nD=M\n@{n_args + 6}\nD=D-A\n@R13\nM=D\n@ARG\nD=M-1\n@R14\nM=D\n' +\
+               '@R13\nAM=M+1\nD=M\n@R14\nAM=M+1\nM=D\n' * (n_args + 5) +\
+               f'@R14\nD=M+1\n@LCL\nM=D\n@SP\nM=D\n@{command.arg1}\n0;JMP\n' +\
+               f'({same_frame})\n' +\
+               f'@SP\nD=M\n@{n_args + 1}\nD=D-A\n@R13\nM=D\n@ARG\nD=M-1\n@R14\nM=D\n' +\
+               '@R13\nAM=M+1\nD=M\n@R14\nAM=M+1\nM=D\n' * n_args +\
+               f'@LCL\nD=M\n@SP\nM=D\n@{command.arg1}\n0;JMP\n'
+
+
+    def direct_address(self, segment, i):
+        ''' Returns the symbol of the RAM address for the temp, pointer and static segments, or None '''
+        if segment == 'temp':
+            return 5 + i
+        elif segment == 'pointer':
+            return pointer_names[i]
+        elif segment == 'static':
+            return f'{self.static}{i}'
+
+
+    def write_load(self, push):
+        ''' Returns: D = value of the push command '''
+        segment, i = push.arg1, push.arg2
+        if segment == 'constant':
+            return f'@{i}\nD=A\n'
+        elif segment == 'stack':
+            return stack_address(i) + 'D=M\n'
+
+        address = self.direct_address(segment, i)
+        if address is not None:
+            return f'@{address}\nD=M\n'
+        elif i == 0:
+            return f'@{segment_pointers[segment]}\nA=M\nD=M\n'
+
+        return f'@{segment_pointers[segment]}\nD=M\n@{i}\nA=D+A\nD=M\n'
+
+
+    def write_move(self, push, pop):
         '''
         Returns:
-        push returnAddress, push LCL, push ARG, push THIS, push THAT,
-        ARG = SP - 5 - nArgs, LCL = SP, goto functionName, (returnAddress)
+        D = value of the push command, destination of the pop command = D,
+        never touching SP. Small indexes are reached incrementing A,
+        the others saving the address in R13
         '''
-        return f'@return_address_{self.f_name}_{C_CALL.id}\nD=A\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
-               '@LCL\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
-               '@ARG\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
-               '@THIS\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
-               '@THAT\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
-               '@nArgs\nD=A\n@5\nD=D+A\n@SP\nD=M-D\n@ARG\nM=D\n'.replace('nArgs', self.n_args) +\
-               '@SP\nD=M\n@LCL\nM=D\n' +\
-               '@f_name\n0;JMP\n'.replace('f_name', self.f_name) +\
-               f'(return_address_{self.f_name}_{C_CALL.id})\n'
+        segment, i = pop.arg1, pop.arg2
+        address = self.direct_address(segment, i)
+        if address is not None:
+            return self.write_load(push) + f'@{address}\nM=D\n'
+        elif segment == 'stack' and i == 0:
+            return self.write_load(push) + '@SP\nA=M\nM=D\n'
+        elif segment == 'stack' and i <= 7:
+            return self.write_load(push) + '@SP\nA=M-1\n' + 'A=A-1\n' * (i - 1) + 'M=D\n'
+        elif segment == 'stack':
+            return f'@SP\nD=M\n@{i}\nD=D-A\n@R13\nM=D\n' +\
+                   self.write_load(push) + '@R13\nA=M\nM=D\n'
+
+        pointer = segment_pointers[segment]
+        if i == 0:
+            return self.write_load(push) + f'@{pointer}\nA=M\nM=D\n'
+        elif i <= 5:
+            return self.write_load(push) + f'@{pointer}\nA=M+1\n' + 'A=A+1\n' * (i - 1) + 'M=D\n'
+
+        return f'@{i}\nD=A\n@{pointer}\nD=D+M\n@R13\nM=D\n' +\
+               self.write_load(push) + '@R13\nA=M\nM=D\n'
+
+
+class CachedCodeWriter(CodeWriter):
+    '''
+    CodeWriter keeping the top of the stack in D: a pushed value stays in D,
+    above the words in RAM, and is written to RAM only when another push needs
+    D or when the whole stack must be in RAM: at labels, jumps, calls, returns
+    and shared routines. A push followed by a pop becomes a move on its own
+    '''
+
+    # Binary operations with x in M and y in D
+    binary_table = {'add' : 'D=D+M', 'sub' : 'D=M-D', 'and' : 'D=D&M', 'or' : 'D=D|M'}
+
+    def __init__(self, file_name, **options):
+        ''' Attribute: cached, True when the top of the stack is in D instead of RAM '''
+        CodeWriter.__init__(self, file_name, **options)
+        self.fuse_moves = False
+        self.cached = False
 
 
-class C_RETURN(object):
-    ''' Class of function return commands '''
+    def translate(self, commands):
+        ''' Yields the translation of every command, then leaves the whole stack in RAM '''
+        yield from CodeWriter.translate(self, commands)
+        asm = self.spill()
+        if self.sizes is not None and asm:
+            self.sizes[self.function, 'spill'] += count_instructions(asm)
+        yield asm
 
-    def write_return(self):
+
+    def site_saving(self, commands, i):
         '''
-        Returns:
-        endFrame = LCL, retAddr = *(endFrame - 5),
-        *ARG = pop(), SP = ARG + 1, THAT = *(endFrame - 1),
-        THIS = *(endFrame - 2), ARG = *(endFrame - 3),
-        LCL = *(endFrame - 4)
+        Returns the instructions saved by translating the comparison commands[i] as a jump
+        to the shared routine. The inline comparison leaves its result in D, the shared one
+        in RAM: the commands after it are translated both ways too, up to the first one
+        leaving the top of the stack in the same place
         '''
-        return '@LCL\nD=M\n@end_frame\nM=D\n' +\
-               '@5\nD=A\n@end_frame\nA=M-D\nD=M\n@R14\nM=D\n' +\
-               '@SP\nA=M-1\nD=M\n@ARG\nA=M\nM=D\n' +\
-               '@ARG\nD=M+1\n@SP\nM=D\n' +\
-               '@end_frame\nAM=M-1\nD=M\n@THAT\nM=D\n' +\
-               '@end_frame\nAM=M-1\nD=M\n@THIS\nM=D\n' +\
-               '@end_frame\nAM=M-1\nD=M\n@ARG\nM=D\n' +\
-               '@end_frame\nAM=M-1\nD=M\n@LCL\nM=D\n' +\
-               '@R14\nA=M\n0;JMP\n'
-
-
-def code_writer(c_type, command, f_name, file_name):
-    '''
-    Arguments: function command_type, command, function_name, file_name
-    Returns the translation of the command
-    '''
-    if c_type == 'C_PUSH':
-        return C_PUSH(command, file_name).write_push()
-    elif c_type == 'C_POP':
-        return C_POP(command, file_name).write_pop()
-    elif c_type == 'C_ARITHMETIC':
-        return C_ARITHMETIC(command).write_arithmetic()
-    elif c_type == 'C_LABEL':
-        return C_LABEL(command, f_name).write_label()
-    elif c_type == 'C_IF':
-        return C_IF(command, f_name).write_if()
-    elif c_type == 'C_GOTO':
-        return C_GOTO(command, f_name).write_goto()
-    elif c_type == 'C_FUNCTION':
-        return C_FUNCTION(command).write_function()
-    elif c_type == 'C_CALL':
-        return C_CALL(command).write_call()
-    elif c_type == 'C_RETURN':
-        return C_RETURN().write_return()
-
-
-def write_init():
+        op = commands[i].op
+        inline, shared = [CachedCodeWriter(self.name, compact = self.compact, shared = tuple(shared), tail_calls = self.tail_calls)
+                          for shared in [set(self.shared) - {op}, self.shared]]
+        for writer in inline, shared:
+            writer.function, writer.cached, writer.measure_sites = self.function, self.cached, False
+
+        saving = 0
+        for inline_asm, shared_asm in zip(inline.translate(commands[i:]), shared.translate(commands[i:])):
+            saving += count_instructions(inline_asm) - count_instructions(shared_asm)
+            if inline.cached == shared.cached:
+                break
+            inline.shared = self.shared
+
+        return saving
+
+
+    def spill(self):
+        ''' Returns the code writing the top of the stack held in D to RAM '''
+        if not self.cached:
+            return ''
+
+        self.cached = False
+        return '@SP\nAM=M+1\nA=A-1\nM=D\n'
+
+
+    def fill(self):
+        ''' Returns the code popping the top of the stack in D, unless it's already there '''
+        if self.cached:
+            self.cached = False
+            return ''
+
+        return '@SP\nAM=M-1\nD=M\n'
+
+
+    def write_store(self, segment, i):
+        ''' Returns: segment i = D. Large indexes save D in R13 and the address in R14 '''
+        address = self.direct_address(segment, i)
+        if address is not None:
+            return f'@{address}\nM=D\n'
+        elif segment == 'stack' and i == 0:
+            return '@SP\nA=M\nM=D\n'
+        elif segment == 'stack' and i <= 7:
+            return '@SP\nA=M-1\n' + 'A=A-1\n' * (i - 1) + 'M=D\n'
+        elif segment == 'stack':
+            return f'@R13\nM=D\n@SP\nD=M\n@{i}\nD=D-A\n@R14\nM=D\n@R13\nD=M\n@R14\nA=M\nM=D\n'
+
+        pointer = segment_pointers[segment]
+        if i == 0:
+            return f'@{pointer}\nA=M\nM=D\n'
+        elif i <= 5:
+            return f'@{pointer}\nA=M+1\n' + 'A=A+1\n' * (i - 1) + 'M=D\n'
+
+        return f'@R13\nM=D\n@{i}\nD=A\n@{pointer}\nD=D+M\n@R14\nM=D\n@R13\nD=M\n@R14\nA=M\nM=D\n'
+
+
+    def write_push(self, command):
+        asm = self.spill() + self.write_load(command)
+        self.cached = True
+        return asm
+
+
+    def write_pop(self, command):
+        return self.fill() + self.write_store(command.arg1, command.arg2)
+
+
+    def write_arithmetic(self, command):
+        op = command.op
+        if op in self.shared:
+            return self.spill() + CodeWriter.write_arithmetic(self, command)
+        elif op in self.binary_table:
+            asm = self.fill() + f'@SP\nAM=M-1\n{self.binary_table[op]}\n'
+        elif op in compare_jumps:
+            true, end = self.unique_label('TRUE_' + op.upper()), self.unique_label('END_' + op.upper())
+            asm = self.fill() + f'@SP\nAM=M-1\nD=M-D\n@{true}\nD;{compare_jumps[op]}\n' +\
+                  f'D=0\n@{end}\n0;JMP\n({true})\nD=-1\n({end})\n'
+        elif self.cached:
+            asm = 'D=-D\n' if op == 'neg' else 'D=!D\n'
+        else:
+            return CodeWriter.write_arithmetic(self, command)
+
+        self.cached = True
+        return asm
+
+
+    def write_label(self, command):
+        return self.spill() + CodeWriter.write_label(self, command)
+
+
+    def write_if(self, command):
+        return self.fill() + f'@{self.function}${command.arg1}\nD;JNE\n'
+
+
+    def write_goto(self, command):
+        return self.spill() + CodeWriter.write_goto(self, command)
+
+
+    def write_function(self, command):
+        return self.spill() + CodeWriter.write_function(self, command)
+
+
+    def write_call(self, command):
+        return self.spill() + CodeWriter.write_call(self, command)
+
+
+    def write_return(self, command):
+        return self.spill() + CodeWriter.write_return(self, command)
+
+
+    def write_tail_call(self, command):
+        return self.spill() + CodeWriter.write_tail_call(self, command)
+
+
+    def write_drop(self, command):
+        if not self.cached:
+            return CodeWriter.write_drop(self, command)
+
+        self.cached = False
+        if command.arg2 == 1:
+            return ''
+
+        return CodeWriter.write_drop(self, command._replace(arg2 = command.arg2 - 1))
+
+
+def make_writer(file_name, cache_top = False, **options):
+    ''' Returns the CodeWriter of the file, keeping the top of the stack in D if cache_top '''
+    if cache_top:
+        return CachedCodeWriter(file_name, **options)
+
+    return CodeWriter(file_name, **options)
+
+
+def write_shared_compare(command, return_address):
+    '''
+    Returns:
+    D = returnAddress, goto $EQ/$GT/$LT, (returnAddress)
+    '''
+    return f'@{return_address}\nD=A\n@${command.upper()}\n0;JMP\n({return_address})\n'
+
+
+def write_compact_call(f_name, n_args, return_address):
+    '''
+    Returns:
+    R13 = functionName, R14 = nArgs, D = returnAddress,
+    goto $CALL, (returnAddress)
+    '''
+    return f'@{f_name}\nD=A\n@R13\nM=D\n' +\
+           f'@{n_args}\nD=A\n@R14\nM=D\n' +\
+           f'@{return_address}\nD=A\n@$CALL\n0;JMP\n' +\
+           f'({return_address})\n'
+
+
+def write_inline_call(f_name, n_args, return_address):
+    '''
+    Returns:
+    push returnAddress, push LCL, push ARG, push THIS, push THAT,
+    ARG = SP - 5 - nArgs, LCL = SP, goto functionName, (returnAddress)
+    '''
+    return f'@{return_address}\nD=A\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@LCL\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@ARG\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@THIS\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@THAT\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           f'@{n_args}\nD=A\n@5\nD=D+A\n@SP\nD=M-D\n@ARG\nM=D\n' +\
+           '@SP\nD=M\n@LCL\nM=D\n' +\
+           f'@{f_name}\n0;JMP\n' +\
+           f'({return_address})\n'
+
+
+def write_inline_return():
+    '''
+    Returns:
+    endFrame = LCL, retAddr = *(endFrame - 5),
+    *ARG = pop(), SP = ARG + 1, THAT = *(endFrame - 1),
+    THIS = *(endFrame - 2), ARG = *(endFrame - 3),
+    LCL = *(endFrame - 4)
+    '''
+    return '@LCL\nD=M\n@end_frame\nM=D\n' +\
+           '@5\nD=A\n@end_frame\nA=M-D\nD=M\n@R14\nM=D\n' +\
+           '@SP\nA=M-1\nD=M\n@ARG\nA=M\nM=D\n' +\
+           '@ARG\nD=M+1\n@SP\nM=D\n' +\
+           '@end_frame\nAM=M-1\nD=M\n@THAT\nM=D\n' +\
+           '@end_frame\nAM=M-1\nD=M\n@THIS\nM=D\n' +\
+           '@end_frame\nAM=M-1\nD=M\n@ARG\nM=D\n' +\
+           '@end_frame\nAM=M-1\nD=M\n@LCL\nM=D\n' +\
+           '@R14\nA=M\n0;JMP\n'
+
+
+def write_shared_calls():
+    '''
+    Returns the routines shared by all the calls and returns in compact mode.
+    $CALL takes functionName in R13, nArgs in R14 and returnAddress in D:
+        push returnAddress, push LCL, push ARG, push THIS, push THAT,
+        ARG = SP - 5 - nArgs, LCL = SP, goto functionName
+    $RETURN is the usual return code
+    '''
+    return '// Shared call and return routines\n' +\
+           '($CALL)\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@LCL\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@ARG\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@THIS\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@THAT\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n' +\
+           '@R14\nD=M\n@5\nD=D+A\n@SP\nD=M-D\n@ARG\nM=D\n' +\
+           '@SP\nD=M\n@LCL\nM=D\n' +\
+           '@R13\nA=M\n0;JMP\n' +\
+           '($RETURN)\n' + write_inline_return()
+
+
+def write_compare_routine(command):
+    '''
+    Returns the routine shared by the eq, gt or lt commands, taking returnAddress in D:
+    R15 = returnAddress, compare the two values on top of the stack, goto R15
+    '''
+    name = command.upper()
+    return f'// Shared {command} routine\n(${name})\n@R15\nM=D\n' +\
+           f'@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@${name}_TRUE\nD;{compare_jumps[command]}\n' +\
+           f'@SP\nA=M-1\nM=0\n(${name}_TRUE)\n@R15\nA=M\n0;JMP\n'
+
+
+def write_halt_loop():
+    ''' Returns the infinite loop in front of the shared routines, stopping the code falling through them '''
+    return '($HALT)\n@$HALT\n0;JMP\n'
+
+
+def write_shared_routines(counts, options):
+    '''
+    Returns the shared routines used by the translated code, given the counts
+    of its calls, returns and shared comparisons and the options of its CodeWriter,
+    behind an infinite loop that stops the code falling through them, and prints
+    the instructions they saved. Returns an empty string if no routine is used
+    '''
+    routines = ''
+    if options['compact'] and (counts['call'] or counts['return']):
+        routines += write_shared_calls()
+        print(f'Compact calls: {counts["call"]} calls, {counts["return"]} returns, '
+              f'{compact_savings(counts["call"], counts["return"])} instructions saved')
+
+    for command in sorted(compare_jumps):
+        if counts[command]:
+            print(f'Shared {command}: {counts[command]} sites, '
+                  f'{compare_savings(command, counts[command + "_saving"], halt = routines == "")} instructions saved')
+            routines += write_compare_routine(command)
+
+    if routines == '':
+        return ''
+
+    return write_halt_loop() + routines
+
+
+def count_instructions(asm):
+    ''' Returns the number of Hack instructions in the assembly code '''
+    return sum(1 for line in asm.split('\n') if line != '' and line[0] not in '(/')
+
+
+def compact_savings(n_calls, n_returns):
+    ''' Returns the number of instructions saved by the compact mode, which pays for the loop in front of the shared routines '''
+    call_saving = count_instructions(write_inline_call('f', 0, 'ret')) - count_instructions(write_compact_call('f', 0, 'ret'))
+    return_saving = count_instructions(write_inline_return()) - 2
+
+    return n_calls * call_saving + n_returns * return_saving - count_instructions(write_shared_calls() + write_halt_loop())
+
+
+def compare_savings(command, site_savings, halt = False):
+    '''
+    Returns the number of instructions saved by the comparisons jumping to the shared routine,
+    given the instructions saved at their sites, less the loop in front of the shared routines if halt
+    '''
+    return site_savings - count_instructions(write_compare_routine(command) + (write_halt_loop() if halt else ''))
+
+
+def choose_shared_compares(counts, options):
+    '''
+    Returns the comparisons that take less ROM with the shared routine, given the
+    counts of the operations in all the sources and the options of the CodeWriter.
+    Every site is translated by the CodeWriter between a push and an if-goto.
+    Without the compact calls, the loop in front of the shared routines is paid by the comparisons
+    '''
+    savings = {}
+    for command in compare_jumps:
+        commands = [Command('push', 'constant', 0), Command(command), Command('if-goto', 'END')]
+        inline, site = [count_instructions(''.join(make_writer('Compare', options.get('cache_top', False), shared = shared).translate(commands)))
+                        for shared in [(), (command,)]]
+        savings[command] = compare_savings(command, counts[command] * (inline - site))
+    shared = {command for command in compare_jumps if savings[command] > 0}
+    if not (options['compact'] and (counts['call'] or counts['return'])) and \
+       sum(savings[command] for command in shared) <= count_instructions(write_halt_loop()):
+        return set()
+
+    return shared
+
+
+def inline_growth(body, options):
+    ''' Returns the instructions added by inlining a call of the function body, translated with the options '''
+    n_args = max([command.arg2 + 1 for command in body if command.arg1 == 'argument'], default = 0)
+    writer = make_writer('Inline', **options)
+    inlined = ''.join(writer.translate(inline_body(body, n_args)))
+
+    return count_instructions(inlined) - count_instructions(writer.write_call(Command('call', body[0].arg1, n_args)))
+
+
+def choose_inlined(summaries, live, options, size, budget):
+    '''
+    Returns {functionName : lines of its body} of the functions to inline among the
+    inlinable ones of at most size commands called by the live functions (all if None).
+    The ones making the code smaller come first, then the others while the
+    instructions they add fit in the budget. Prints the choices
+    '''
+    sites, bodies = Counter(), {}
+    for summary in summaries:
+        for name, function in summary.items():
+            if live is None or name in live:
+                sites.update(function['calls'])
+            if 'body' in function and len(function['body']) <= size:
+                bodies[name] = function['body']
+
+    costs = sorted((inline_growth(parse_vm(body), options) * sites[name], name) for name, body in bodies.items() if sites[name])
+    chosen = {}
+    for cost, name in costs:
+        if cost > budget:
+            break
+        budget -= max(cost, 0)
+        chosen[name] = bodies[name]
+        print(f'Inlined {name}: {sites[name]} calls, {cost:+d} instructions')
+
+    return chosen
+
+
+def size_report(sizes):
+    '''
+    Returns the report of the code size as JSON serializable data, given the
+    [file, function, operation, instructions] of the translation: the total
+    and the instructions of every file, function and operation, largest first.
+    The code before the first function of a file is in the function "file:"
+    '''
+    files, functions, operations = Counter(), Counter(), Counter()
+    for file, function, op, n in sizes:
+        files[file] += n
+        functions[function or f'{file}:'] += n
+        operations[op] += n
+
+    return {'total' : sum(files.values()),
+            'rom_size' : ROM_SIZE,
+            'files' : dict(files.most_common()),
+            'functions' : dict(functions.most_common()),
+            'operations' : dict(operations.most_common())}
+
+
+def print_size_report(report):
+    ''' Prints the size report as tables of instructions and percentages of the total '''
+    total = report['total']
+    print(f'Code size: {total} instructions, {100 * total / report["rom_size"]:.1f}% of the ROM')
+    for title in ['files', 'functions', 'operations']:
+        print(f'\n{title.capitalize():<40} {"instructions":>12} {"%":>6}')
+        for name, n in report[title].items():
+            print(f'{name:<40} {n:>12} {100 * n / max(total, 1):>6.1f}')
+
+
+def write_init(writer):
     ''' 
-    Returns bootstrap code:
+    Returns bootstrap code, translated by the CodeWriter:
     SP = 256, call Sys.init()
     '''
     return '// Boostrap code\n' +\
            '@256\nD=A\n@SP\nM=D\n' +\
-           code_writer('C_CALL', 'call Sys.init 0', 'Sys.init', '')
+           writer.write_call(Command('call', 'Sys.init', 0))
 
 
-def file_writer(vm_file, asm_file, file_name):
+def read_vm(path, optimized = False):
     '''
-    Arguments: file.vm, file.asm, (str) name of file
-    Translate all the lines of a vm file in the asm file
+    Returns (list of Commands of the vm file, optimized if required,
+    number of commands before the optimization)
     '''
-    function_name = ''
-    for line in vm_file:
-            line = clean_line(line)
-            if line != '':
-                # Save the name of the function for later use
-                if line.split()[0] == 'function':
-                    function_name = line.split()[1]
+    with open(path, 'r') as vm_file:
+        commands = parse_vm(vm_file)
+    if optimized:
+        return optimize(commands), len(commands)
 
-                # Increase the line counter and translate the command into the asm file
-                asm_file.write('// ' + line + '\n' + code_writer(command_type(line), line, function_name, file_name))
+    return commands, len(commands)
 
-def main():
-    ''' Main function '''
-    if len(argv) != 2:
-        print("Usage: VMtranslator.py fileName.vm/directoryName")
-        exit(1)
 
-    try:
-        # Open an asm file for writing
-        asm_file = open(argv[1].replace('vm', 'asm'), 'w')
+def summarize_file(path, optimized = False, cache = None):
+    '''
+    Returns the summary of the functions of the vm file: their calls and
+    the counts of their operations, read from the FragmentCache if unchanged
+    '''
+    if cache is not None:
+        key = cache.key(path, f'summary:{optimized:d}')
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
 
-    except IsADirectoryError:
-        # asm file name = DirectoryName.asm
-        asm_file = open(argv[1].split('/')[-1] + '.asm', 'w')
+    summary = summarize(read_vm(path, optimized)[0])
+    if cache is not None:
+        cache.put(key, summary, '')
 
-    # if input == file.vm
-    if isfile(argv[1]):
-        with open(argv[1], 'r') as vm_file:
-            file_writer(vm_file, asm_file, argv[1])
+    return summary
 
-    # If input == directory
-    else:
-        # Create a list with all the .vm files in the directory
-        files = [vm for vm in listdir(argv[1]) if '.vm' in vm]
 
-        # Write the bootstrap code if Sys.vm exist
-        if 'Sys.vm' in files:
-            asm_file.write(write_init())
+def translate_file(path, removed = (), inlined = (), optimized = False, cache = None, **options):
+    '''
+    Arguments: path of the vm file, functions to remove, (functionName, lines of its body)
+    of the functions to inline, optimize its commands, FragmentCache, options of the CodeWriter.
+    The file is read and translated on its own, so it can run in a worker process,
+    and the translation of an unchanged file is read back from the cache.
+    Returns (translation of the commands, counts of the calls, returns and shared
+    comparisons, number of commands before and after the optimization, cache hit,
+    list of [function, operation, instructions] if the sizes are counted)
+    '''
+    if cache is not None:
+        key = cache.key(path, f'{optimized:d}:{removed}:{inlined}:{sorted(options.items())}')
+        entry = cache.get(key)
+        if entry is not None:
+            data, asm = entry
+            return asm, Counter(data['counts']), data['commands'], data['optimized'], True, data['sizes']
+
+    commands, n_commands = read_vm(path, optimized)
+    n_optimized = len(commands)
+    writer = make_writer(basename(path), **options)
+    bodies = {name : parse_vm(body) for name, body in inlined}
+    asm = ''.join(writer.translate(inline_calls(remove_functions(commands, removed), bodies)))
+    sizes = None if writer.sizes is None else [[function, op, n] for (function, op), n in writer.sizes.items()]
+    if cache is not None:
+        cache.put(key, {'counts' : writer.counts, 'commands' : n_commands, 'optimized' : n_optimized, 'sizes' : sizes}, asm)
+
+    return asm, writer.counts, n_commands, n_optimized, False, sizes
+
+
+def output_name(path):
+    ''' Returns the path of the output files without extension: fileName next to the vm file, or DirectoryName here '''
+    if isfile(path):
+        return splitext(path)[0]
+
+    return basename(normpath(path))
+
+
+def parse_args(args):
+    ''' Returns the parsed command line arguments '''
+    parser = argparse.ArgumentParser(prog = 'VMtranslator.py',
+                                     description = 'Translates VM code into Hack assembly')
+    parser.add_argument('path', metavar = 'fileName.vm/directoryName')
+    parser.add_argument('--compact-calls', action = 'store_true',
+                        help = 'jump to one shared call and one shared return routine instead of inlining them')
+    parser.add_argument('--shared-compare', choices = ['inline', 'shared', 'auto'], default = 'inline',
+                        help = 'translate eq, gt and lt inline, as jumps to a shared routine, or choose '
+                               'for each of them the form that takes less ROM (default: %(default)s)')
+    parser.add_argument('--fuse-moves', action = 'store_true',
+                        help = 'translate a push immediately followed by a pop as a direct move')
+    parser.add_argument('--tail-calls', action = 'store_true',
+                        help = 'translate a call immediately followed by a return reusing the frame of the function')
+    parser.add_argument('--cache-top', action = 'store_true',
+                        help = 'keep the top of the stack in D, writing it to RAM only when needed')
+    parser.add_argument('-O', '--optimize', action = 'store_true',
+                        help = 'fold constants and remove useless commands before translating')
+    parser.add_argument('--remove-unreachable', action = 'store_true',
+                        help = 'leave out the functions that can not be reached from Sys.init through calls')
+    parser.add_argument('--inline', action = 'store_true',
+                        help = 'replace the calls of small functions without calls nor branches with their body')
+    parser.add_argument('--inline-size', type = int, default = 12,
+                        help = 'maximum number of VM commands of an inlined function (default: %(default)s)')
+    parser.add_argument('--inline-budget', type = int, default = 1000,
+                        help = 'maximum number of instructions the inlining can add (default: %(default)s)')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--emit', choices = ROM_FORMATS,
+                        help = 'write the machine code directly, as text .hack or binary .hackb, instead of the asm file')
+    output.add_argument('--object', action = 'store_true',
+                        help = 'write a relocatable object module fileName.hobj next to every vm file, '
+                               'to be linked with HackLinker.py, instead of the asm file')
+    parser.add_argument('--listing', action = 'store_true',
+                        help = 'with --emit, also write the asm file as a listing of the machine code')
+    parser.add_argument('--size-report', action = 'store_true',
+                        help = 'print the instructions of every file, function and VM operation')
+    parser.add_argument('--size-json', metavar = 'file.json',
+                        help = 'write the report of the code size in this file as JSON')
+    parser.add_argument('-j', '--jobs', type = int, default = None,
+                        help = 'number of worker processes translating the files of a directory (default: one per core)')
+    parser.add_argument('--no-cache', action = 'store_true',
+                        help = 'always translate every file, without reading or writing the cache of fragments')
+    parser.add_argument('--cache-dir', default = DEFAULT_CACHE_DIR,
+                        help = f'directory of the cache (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-size', type = float, default = DEFAULT_CACHE_SIZE / (1024 * 1024),
+                        help = 'size of the cache in MB before old entries are evicted (default: %(default)g)')
+    return parser.parse_args(args)
 
-        # Iterate over vm files in the list and translate each one
-        for file in files:
-            with open(argv[1] + '/' + file, 'r') as vm_file:
-                file_writer(vm_file, asm_file, file)
 
-    #Close the asm_file
-    asm_file.close()
+def main():
+    ''' Main function '''
+    args = parse_args(argv[1:])
+    cache = None
+    if not args.no_cache:
+        from VMcache import FragmentCache
+        cache = FragmentCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+    if args.emit is not None or args.object:
+        from VMbinary import Emitter, write_rom, object_module, write_object
+
+    # asm file name = fileName.asm, or DirectoryName.asm in the current directory
+    asm_path = output_name(args.path) + '.asm'
+
+    # The Emitter encodes the code as it is written, the asm file is only an optional listing.
+    # Object modules are written apart, the bootstrap and the shared routines are left to the linker
+    if args.object:
+        asm_file = None
+    elif args.emit is None:
+        asm_file = open(asm_path, 'w')
+    else:
+        asm_file = Emitter(open(asm_path, 'w') if args.listing else None)
 
-main()
+    # Create a list with the vm file, or all the .vm files in the directory
+    if isfile(args.path):
+        paths = [args.path]
+    else:
+        paths = [join(args.path, vm) for vm in sorted(listdir(args.path)) if '.vm' in vm]
+
+    # The workers get the size of the cache scanned once here, so they scan it
+    # again only if it gets full, and the entries they add are evicted at the end
+    if cache is not None:
+        cache.evict()
+
+    # Every file is read and translated on its own, in a pool of processes if there are more
+    with ProcessPoolExecutor(max_workers = args.jobs) as pool:
+        job_map = pool.map if len(paths) > 1 and args.jobs != 1 else map
+
+        # The whole program is analysed on the summaries of its files
+        bootstrap = not isfile(args.path) and 'Sys.vm' in map(basename, paths)
+        if args.shared_compare == 'auto' or args.remove_unreachable or args.inline:
+            summaries = list(job_map(partial(summarize_file, optimized = args.optimize, cache = cache), paths))
+
+        # Functions reachable from the bootstrap, None keeps them all
+        live = None
+        if args.remove_unreachable and not bootstrap:
+            print('No Sys.vm to start from: every function is kept')
+        elif args.remove_unreachable:
+            live = reachable(summaries, ['Sys.init'])
+
+        options = {'compact' : args.compact_calls, 'shared' : (),
+                   'fuse_moves' : args.fuse_moves, 'tail_calls' : args.tail_calls, 'cache_top' : args.cache_top}
+        if args.shared_compare == 'shared':
+            options['shared'] = tuple(sorted(compare_jumps))
+        elif args.shared_compare == 'auto':
+            operations = Counter()
+            for summary in summaries:
+                for name, function in summary.items():
+                    if live is None or name in live:
+                        operations.update(function['operations'])
+            options['shared'] = tuple(sorted(choose_shared_compares(operations, options)))
+        if args.size_report or args.size_json:
+            options['sizes'] = True
+
+        # Every file gets the bodies of the inlined functions it calls. Once
+        # all their calls are inlined, the functions may become unreachable
+        inlined = [()] * len(paths)
+        if args.inline:
+            bodies = choose_inlined(summaries, live, options, args.inline_size, args.inline_budget)
+            inlined = [tuple((name, tuple(bodies[name])) for name in sorted(bodies)
+                             if any(name in function['calls'] for function in summary.values()))
+                       for summary in summaries]
+            if live is not None:
+                live = reachable(summaries, ['Sys.init'], bodies)
+
+        removed = [()] * len(paths)
+        if live is not None:
+            removed = [tuple(sorted(set(summary) - live)) for summary in summaries]
+            for path, functions in zip(paths, removed):
+                if functions:
+                    print(f'{basename(path)}: removed {len(functions)} unreachable functions: {", ".join(functions)}')
+
+        # Write the bootstrap code if Sys.vm exist
+        counts = Counter()
+        sizes = []
+        if bootstrap and asm_file is not None:
+            init_writer = make_writer('Bootstrap', **options)
+            init = write_init(init_writer)
+            asm_file.write(init)
+            counts.update(init_writer.counts)
+            sizes.append(['Bootstrap', '', 'bootstrap', count_instructions(init)])
+
+        # The translations, new or cached, are linked in the order of the files
+        hits = 0
+        translate = partial(translate_file, optimized = args.optimize, cache = cache, **options)
+        translations = job_map(translate, paths, removed, inlined)
+        for path, (asm, file_counts, n_commands, n_optimized, hit, file_sizes) in zip(paths, translations):
+            if args.optimize:
+                print(f'{basename(path)}: {n_commands} -> {n_optimized} VM commands')
+            if args.object:
+                linking = {'compact' : args.compact_calls, 'shared' : list(options['shared'])}
+                module = object_module(asm, splitext(basename(path))[0], linking, file_counts)
+                write_object(module, splitext(path)[0] + '.hobj')
+            else:
+                asm_file.write(asm)
+            counts.update(file_counts)
+            hits += hit
+            sizes += [[basename(path)] + size for size in file_sizes or []]
+
+    if cache is not None:
+        cache.evict()
+    if cache is not None and len(paths) > 1:
+        print(f'Cache: {len(paths) - hits} files translated, {hits} unchanged')
+
+    if args.tail_calls:
+        print(f'Tail calls: {counts["tail_call"]}')
+
+    # The shared routines go after all the code
+    routines = ''
+    if asm_file is not None:
+        routines = write_shared_routines(counts, options)
+        asm_file.write(routines)
+
+    #Close the asm_file, or link the machine code
+    if args.emit is not None:
+        write_rom(asm_file.link(), output_name(args.path) + '.' + args.emit, args.emit)
+        if asm_file.listing is not None:
+            asm_file.listing.close()
+    elif asm_file is not None:
+        asm_file.close()
+
+    if args.size_report or args.size_json:
+        if routines:
+            sizes.append(['Shared routines', '', 'shared routines', count_instructions(routines)])
+        report = size_report(sizes)
+        if args.size_report:
+            print_size_report(report)
+        if args.size_json:
+            with open(args.size_json, 'w') as file:
+                file.write(json.dumps(report, indent = 2) + '\n')
+
+if __name__ == '__main__':
+    main()